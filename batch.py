@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+MFBN batch: coarsening of many networks or parameter sets in one run
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program comes with ABSOLUTELY NO WARRANTY. THE ENTIRE RISK AS TO THE QUALITY AND PERFORMANCE OF THE PROGRAM IS
+WITH YOU.
+
+Owner or contributors are not liable for any direct, indirect, incidental, special, exemplary, or consequential
+damages, (such as loss of data or profits, and others) arising in any way out of the use of this software,
+even if advised of the possibility of such damage.
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+
+Giving credit to the author by citing the papers.
+"""
+
+__maintainer__ = 'Alan Valejo'
+__email__ = 'alanvalejo@gmail.com'
+__author__ = 'Alan Valejo'
+__credits__ = ['Alan Valejo']
+__homepage__ = 'https://www.alanvalejo.com.br'
+__license__ = 'GNU.GPL.v3'
+__docformat__ = 'markdown en'
+__version__ = '0.1'
+__date__ = '2020-05-05'
+
+import sys
+import os
+import inspect
+import json
+import multiprocessing as mp
+
+import mfbn
+import models.args as args
+
+from models.timing import Timing
+
+# Graphs of the inputs of the manifest, loaded once and shared by the runs of a process
+loaded_graphs = {}
+
+
+def graph_key(options):
+    """ Key of the graph a run reads; runs with the same key share the loaded graph. """
+
+    return os.path.abspath(options.input), tuple(options.vertices), options.no_cache
+
+
+def read_manifest(filename):
+    """
+    Configurations of a manifest, a JSON list whose items are configurations
+    (as the --conf files) or paths of configuration files relative to it.
+    """
+
+    with open(filename) as f:
+        manifest = json.load(f)
+
+    confs = []
+    for item in manifest:
+        if not isinstance(item, dict):
+            with open(os.path.join(os.path.dirname(os.path.abspath(filename)), item)) as f:
+                item = json.load(f)
+        confs.append(item)
+    return confs
+
+
+def init_worker(graphs, schemas):
+    """ Share the graphs and the argument schemas loaded by the main process with a worker. """
+
+    loaded_graphs.update(graphs)
+    args.schemas.update(schemas)
+
+
+def check_conf(conf):
+    """
+    Load the graph of a configuration of the manifest, if not loaded yet, and
+    check its parameters. Returns the error, or None if it is valid.
+    """
+
+    from models.coarsening import Coarsening
+
+    try:
+        options = mfbn.setup_options([], conf)
+        if options.input is None or options.vertices is None:
+            return 'Input and vertices are required in each configuration of the manifest.'
+        key = graph_key(options)
+        if key not in loaded_graphs:
+            loaded_graphs[key] = mfbn.load_graph(options)
+        Coarsening(loaded_graphs[key], **mfbn.coarsening_kwargs(options))
+    except (ValueError, OSError) as error:
+        return str(error)
+    return None
+
+
+def run_conf(conf):
+    """ Run one configuration of the manifest on its already loaded graph; returns its output and error. """
+
+    options = mfbn.setup_options([], conf)
+    timing = Timing(['Snippet', 'Time [m]', 'Time [s]'])
+    try:
+        mfbn.run(options, loaded_graphs[graph_key(options)], timing)
+    except ValueError as error:
+        return options.output, str(error)
+    return options.output, None
+
+
+def main():
+    """
+    Main entry point for the application when run from the command line.
+    """
+
+    current_path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+    parser = args.setup_parser(current_path + '/args/batch.json')
+    options = parser.parse_args()
+
+    confs = read_manifest(options.manifest)
+    if options.threads > 1:
+        # Runs of a pool cannot start pools of their own
+        confs = [dict(conf, threads=1) for conf in confs]
+
+    # Load each distinct input and the argument schema once, and check every configuration before any run starts
+    errors = [check_conf(conf) for conf in confs]
+    valid = [conf for conf, error in zip(confs, errors) if error is None]
+
+    if options.threads > 1 and valid:
+        pool = mp.Pool(processes=options.threads, initializer=init_worker, initargs=(loaded_graphs, args.schemas))
+        try:
+            results = pool.map(run_conf, valid, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [run_conf(conf) for conf in valid]
+
+    results = iter(results)
+    failed = 0
+    for index, error in enumerate(errors):
+        if error is None:
+            output, error = next(results)
+        if error is None:
+            print(output)
+        else:
+            failed += 1
+            print('Configuration ' + str(index) + ' failed: ' + error)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Regression benchmark of the matching kernels
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program comes with ABSOLUTELY NO WARRANTY. THE ENTIRE RISK AS TO THE QUALITY AND PERFORMANCE OF THE PROGRAM IS
+WITH YOU.
+
+Owner or contributors are not liable for any direct, indirect, incidental, special, exemplary, or consequential
+damages, (such as loss of data or profits, and others) arising in any way out of the use of this software,
+even if advised of the possibility of such damage.
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+
+Giving credit to the author by citing the papers.
+"""
+
+__maintainer__ = 'Alan Valejo'
+__email__ = 'alanvalejo@gmail.com'
+__author__ = 'Alan Valejo'
+__credits__ = ['Alan Valejo']
+__homepage__ = 'https://www.alanvalejo.com.br'
+__license__ = 'GNU.GPL.v3'
+__docformat__ = 'markdown en'
+__version__ = '0.1'
+__date__ = '2020-05-05'
+
+import os
+import sys
+import time
+import numpy
+import argparse
+
+# Repository root, where the models package is
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from models.mgraph import greedy_matching, visit_matching
+
+
+def sequential_matching(edge_rows, edge_cols, order, vcount, merge_count):
+    """ Reference greedy pass over the edges in order, one edge at a time. """
+
+    free = numpy.ones(vcount, dtype=bool)
+    accepted = []
+    for edge in order.tolist():
+        if len(accepted) == merge_count:
+            break
+        if free[edge_rows[edge]] and free[edge_cols[edge]]:
+            free[edge_rows[edge]] = False
+            free[edge_cols[edge]] = False
+            accepted.append(edge)
+    return edge_rows[accepted], edge_cols[accepted]
+
+
+def sequential_visits(edge_rows, edge_cols, scores, rank, merge_count):
+    """ Reference visit of the vertices in rank order, one vertex at a time, alone if no neighbor is free. """
+
+    vcount = len(rank)
+    neighbors = [[] for _ in range(vcount)]
+    for vertex, neighbor, score in zip(edge_rows.tolist(), edge_cols.tolist(), scores.tolist()):
+        neighbors[vertex].append((neighbor, score))
+    free = numpy.ones(vcount, dtype=bool)
+    vertices, partners = [], []
+    for vertex in numpy.argsort(rank).tolist():
+        if len(vertices) == merge_count:
+            break
+        if not free[vertex]:
+            continue
+        best, best_score = vertex, 0.0
+        for neighbor, score in sorted(neighbors[vertex]):
+            if neighbor != vertex and free[neighbor] and score > best_score:
+                best, best_score = neighbor, score
+        free[vertex] = False
+        free[best] = False
+        vertices.append(vertex)
+        partners.append(best)
+    return numpy.array(vertices, dtype=numpy.int64), numpy.array(partners, dtype=numpy.int64)
+
+
+def random_edges(generator, vcount, ecount, levels=None):
+    """ Random edges without self-loops, weighted uniformly or by one of levels tied values. """
+
+    rows = generator.integers(0, vcount, ecount)
+    cols = generator.integers(0, vcount, ecount)
+    mask = rows != cols
+    rows, cols = rows[mask], cols[mask]
+    if levels is None:
+        weights = generator.random(len(rows))
+    else:
+        weights = generator.integers(0, levels, len(rows)).astype(numpy.float64)
+    return rows, cols, weights
+
+
+def path_edges(vcount, weights):
+    """ Path 0 - 1 - ... - vcount - 1 with the given weights. """
+
+    rows = numpy.arange(vcount - 1)
+    return rows, rows + 1, numpy.asarray(weights, dtype=numpy.float64)
+
+
+def cases(generator, size):
+    """ Named (rows, cols, weights, vcount) inputs, including chains of tied weights. """
+
+    yield 'random weights', random_edges(generator, size, 4 * size) + (size,)
+    yield 'three tied weights', random_edges(generator, size, 4 * size, levels=3) + (size,)
+    yield 'equal-weight path', path_edges(size, numpy.ones(size - 1)) + (size,)
+    yield 'increasing path', path_edges(size, numpy.arange(size - 1)) + (size,)
+    rows = numpy.repeat(numpy.arange(size // 2), 3)
+    cols = size // 2 + numpy.minimum(rows + numpy.tile(numpy.arange(3), size // 2), size // 2 - 1)
+    yield 'equal-weight band', (rows, cols, numpy.ones(len(rows)), size)
+
+
+def kernels(generator, rows, cols, weights, vcount):
+    """ Named (kernel, reference, arguments) runs of a case: greedy matching and visits in random order. """
+
+    order = numpy.argsort(-weights, kind='stable')
+    yield 'greedy', greedy_matching, sequential_matching, (rows, cols, order, vcount, vcount // 2)
+    rank = numpy.empty(vcount, dtype=numpy.int64)
+    rank[generator.permutation(vcount)] = numpy.arange(vcount)
+    arguments = (numpy.concatenate([rows, cols]), numpy.concatenate([cols, rows]), numpy.concatenate([weights, weights]),
+                 rank, vcount // 2)
+    yield 'visit', visit_matching, sequential_visits, arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the matching kernels against sequential passes and time them.')
+    parser.add_argument('-n', '--size', type=int, default=32000, help='number of vertices of each case')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the random cases')
+    options = parser.parse_args()
+
+    generator = numpy.random.default_rng(options.seed)
+    failures = 0
+    print('%-20s %-8s %10s %12s %14s %8s' % ('Case', 'Kernel', 'Edges', 'Kernel [s]', 'Sequential [s]', 'Equal'))
+    for name, (rows, cols, weights, vcount) in cases(generator, options.size):
+        for kernel_name, kernel, reference, arguments in kernels(generator, rows, cols, weights, vcount):
+            start = time.perf_counter()
+            result = kernel(*arguments)
+            kernel_time = time.perf_counter() - start
+            start = time.perf_counter()
+            expected = reference(*arguments)
+            sequential_time = time.perf_counter() - start
+            equal = all(numpy.array_equal(a, b) for a, b in zip(result, expected))
+            failures += not equal
+            print('%-20s %-8s %10d %12.3f %14.3f %8s' % (
+                name, kernel_name, len(rows), kernel_time, sequential_time, equal
+            ))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
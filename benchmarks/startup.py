@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark of the mfbn command line
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program comes with ABSOLUTELY NO WARRANTY. THE ENTIRE RISK AS TO THE QUALITY AND PERFORMANCE OF THE PROGRAM IS
+WITH YOU.
+
+Owner or contributors are not liable for any direct, indirect, incidental, special, exemplary, or consequential
+damages, (such as loss of data or profits, and others) arising in any way out of the use of this software,
+even if advised of the possibility of such damage.
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+
+Giving credit to the author by citing the papers.
+"""
+
+__maintainer__ = 'Alan Valejo'
+__email__ = 'alanvalejo@gmail.com'
+__author__ = 'Alan Valejo'
+__credits__ = ['Alan Valejo']
+__homepage__ = 'https://www.alanvalejo.com.br'
+__license__ = 'GNU.GPL.v3'
+__docformat__ = 'markdown en'
+__version__ = '0.1'
+__date__ = '2020-05-05'
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# Repository root, where mfbn.py is
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Small network run by the benchmark
+SMALL_INPUT = ['-in', os.path.join(ROOT, 'input', 'moreno.ncol'), '-v', '754', '509']
+
+
+def measure(command, repeat):
+    """ Wall times, in seconds, of repeat cold runs of a command. """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start time of mfbn.py --help and of a small-graph run.')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='number of runs of each command')
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='mfbn-startup-')
+    mfbn = [sys.executable, os.path.join(ROOT, 'mfbn.py')]
+    commands = [
+        ('mfbn.py --help', mfbn + ['--help']),
+        ('mfbn.py small graph', mfbn + SMALL_INPUT + ['-dir', directory, '-nc']),
+    ]
+    try:
+        print('%-22s %10s %10s %10s' % ('Command', 'Min [s]', 'Median [s]', 'Max [s]'))
+        for name, command in commands:
+            times = measure(command, options.repeat)
+            print('%-22s %10.3f %10.3f %10.3f' % (name, min(times), statistics.median(times), max(times)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
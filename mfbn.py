@@ -59,17 +59,19 @@ For now, you can use this version without guarantee of the results.
 """
 
 import sys
-import numpy
 import os
 import inspect
 import json
+import shutil
+import tempfile
 
-from models.mgraph import MGraph
-from models.coarsening import Coarsening
 import models.args as args
 
 from models.timing import Timing
 
+# numpy, scipy and the models are imported by load_graph and run, so that
+# parsing the command line (e.g. --help) does not pay for them
+
 __maintainer__ = 'Alan Valejo'
 __email__ = 'alanvalejo@gmail.com'
 __author__ = 'Alan Valejo'
@@ -81,6 +83,32 @@ __version__ = '0.1.0'
 __date__ = '2020-04-25'
 
 
+def setup_options(argv=None, conf=None):
+    """
+    Options of a run: the command line (argv) updated by its --conf file and,
+    if given, by the conf dictionary.
+    """
+
+    current_path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+    parser = args.setup_parser(current_path + '/args/mfbn.json')
+    options = parser.parse_args(argv)
+    args.update_json(options)
+    if conf is not None:
+        vars(options).update(conf)
+    args.check_output(options)
+    return options
+
+
+def load_graph(options):
+    """ Bipartite graph of the input of a run. """
+
+    from models.mgraph import MGraph
+
+    source_graph = MGraph()
+    source_graph.load(options.input, options.vertices, cache=not options.no_cache)
+    return source_graph
+
+
 def main():
     """
     Main entry point for the application when run from the command line.
@@ -92,11 +120,7 @@ def main():
     with timing.timeit_context_add('Pre-processing'):
 
         # Setup parse options command line
-        current_path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-        parser = args.setup_parser(current_path + '/args/mfbn.json')
-        options = parser.parse_args()
-        args.update_json(options)
-        args.check_output(options)
+        options = setup_options()
 
         if options.input and options.vertices is None:
             print('Vertices are required when input is given.')
@@ -105,109 +129,145 @@ def main():
     # Load bipartite graph
     with timing.timeit_context_add('Load graph'):
 
-        source_graph = MGraph()
-        source_graph.load(options.input, options.vertices)
-
-    # Coarsening
-    with timing.timeit_context_add('Coarsening'):
-
-        kwargs = dict(
-            reduction_factor=options.reduction_factor, max_levels=options.max_levels,
-            matching=options.matching, similarity=options.similarity, itr=options.itr,
-            upper_bound=options.upper_bound, gmv=options.gmv,
-            tolerance=options.tolerance, reverse=options.reverse, seed_priority=options.seed_priority,
-            threads=options.threads
-        )
-
-        coarsening = Coarsening(source_graph, **kwargs)
-        coarsening.run()
-
-    # Save
-    with timing.timeit_context_add('Save'):
-
-        output = options.output
-        for index, obj in enumerate(zip(coarsening.hierarchy_levels, coarsening.hierarchy_graphs)):
-            level, coarsened_graph = obj
-            index += 1
-
-            if options.save_conf or options.show_conf:
-                d = {
-                    'source_input': options.input
-                    , 'source_vertices': source_graph['vertices']
-                    , 'source_vcount': source_graph.vcount()
-                    , 'source_ecount': source_graph.ecount()
-                    , 'coarsened_ecount': coarsened_graph.ecount()
-                    , 'coarsened_vcount': coarsened_graph.vcount()
-                    , 'coarsened_vertices': coarsened_graph['vertices']
-                    , 'achieved_levels': coarsened_graph['level']
-                    , 'reduction_factor': options.reduction_factor
-                    , 'max_levels': options.max_levels
-                    , 'similarity': options.similarity
-                    , 'matching': options.matching
-                    , 'upper_bound': options.upper_bound
-                    , 'gmv': options.gmv
-                    , 'itr': options.itr
-                    , 'level': level
-                }
-
-            if options.save_conf:
-                with open(output + '-' + str(index) + '-info.json', 'w+') as f:
-                    json.dump(d, f, indent=4)
-
-            if options.show_conf:
-                print(json.dumps(d, indent=4))
-
-            if options.save_ncol:
-                coarsened_graph.write(output + '-' + str(index) + '.ncol', format='ncol')
-
-            if options.save_source:
-                with open(output + '-' + str(index) + '.source', 'w+') as f:
-                    for v in coarsened_graph.vs():
-                        f.write(' '.join(map(str, v['source'])) + '\n')
-
-            if options.save_membership:
-                membership = [0] * (source_graph['vertices'][0] + source_graph['vertices'][1])
-                for v in coarsened_graph.vs():
-                    for source in v['source']:
-                        membership[source] = v.index
-                numpy.savetxt(output + '-' + str(index) + '.membership', membership, fmt='%d')
-
-            if options.save_predecessor:
-                with open(output + '-' + str(index) + '.predecessor', 'w+') as f:
-                    for v in coarsened_graph.vs():
-                        f.write(' '.join(map(str, v['predecessor'])) + '\n')
-
-            if options.save_successor:
-                numpy.savetxt(output + '-' + str(index) + '.successor', coarsened_graph.vs['successor'], fmt='%d')
-
-            if options.save_weight:
-                numpy.savetxt(output + '-' + str(index) + '.weight', coarsened_graph.vs['weight'], fmt='%d')
-
-            if options.save_gml:
-                del coarsened_graph['adjlist']
-                del coarsened_graph['similarity']
-                coarsened_graph['layers'] = str(coarsened_graph['layers'])
-                coarsened_graph['vertices'] = ','.join(map(str, coarsened_graph['vertices']))
-                coarsened_graph['level'] = ','.join(map(str, coarsened_graph['level']))
-                coarsened_graph.vs['name'] = map(str, range(0, coarsened_graph.vcount()))
-                coarsened_graph.vs['type'] = map(str, coarsened_graph.vs['type'])
-                coarsened_graph.vs['weight'] = map(str, coarsened_graph.vs['weight'])
-                coarsened_graph.vs['successor'] = map(str, coarsened_graph.vs['successor'])
-                for v in coarsened_graph.vs():
-                    v['source'] = ','.join(map(str, v['source']))
-                    v['predecessor'] = ','.join(map(str, v['predecessor']))
-                coarsened_graph.write(output + '-' + str(index) + '.gml', format='gml')
-
-            if not options.save_hierarchy:
-                break
+        source_graph = load_graph(options)
+
+    try:
+        run(options, source_graph, timing)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+
+
+def coarsening_kwargs(options):
+    """ Parameters of the Coarsening of a run. """
+
+    return dict(
+        reduction_factor=options.reduction_factor, max_levels=options.max_levels,
+        matching=options.matching, similarity=options.similarity, itr=options.itr,
+        upper_bound=options.upper_bound, gmv=options.gmv, mlpb_chunk=options.mlpb_chunk,
+        tolerance=options.tolerance, reverse=options.reverse, seed_priority=options.seed_priority,
+        top_k=options.top_k, hub_degree=options.hub_degree, hub_sample=options.hub_sample,
+        similarity_cache=options.similarity_cache,
+        projection_threshold=options.projection_threshold, projection_mem_limit=options.projection_mem_limit,
+        mnmf_rank=options.mnmf_rank, mnmf_itr=options.mnmf_itr, mnmf_batch=options.mnmf_batch,
+        mnmf_warm_start=options.mnmf_warm_start, threads=options.threads,
+        hierarchy_directory=options.hierarchy_directory
+    )
+
 
+def run(options, source_graph, timing):
+    """
+    Coarsen the source graph with the options of a run and write its outputs.
+    Raises ValueError if the options are invalid, before anything is written.
+    """
+
+    from models.coarsening import Coarsening
+
+    coarsening = Coarsening(source_graph, **coarsening_kwargs(options))
+
+    # Levels are written to disk as soon as they are contracted; without an explicit
+    # directory a temporary one is created in the output directory and always removed
+    hierarchy_directory = options.hierarchy_directory
+    if hierarchy_directory is None:
+        hierarchy_directory = tempfile.mkdtemp(prefix='.hierarchy-', dir=options.output_directory)
+        coarsening.set_hierarchy_directory(hierarchy_directory)
+
+    try:
+        with timing.timeit_context_add('Coarsening'):
+            coarsening.run()
+
+        # Save
+        with timing.timeit_context_add('Save'):
+            save(options, source_graph, coarsening)
+    finally:
+        if options.hierarchy_directory is None:
+            shutil.rmtree(hierarchy_directory, ignore_errors=True)
+
+    output = options.output
     if options.show_timing:
         timing.print_tabular()
+        if options.similarity_cache:
+            from models.similarity import Similarity
+
+            print('Similarity cache: ' + str(Similarity.cache.hits) + ' hits, ' + str(Similarity.cache.misses)
+                  + ' misses')
     if options.save_timing_csv:
         timing.save_csv(output + '-timing.csv')
     if options.save_timing_json:
         timing.save_json(output + '-timing.json')
 
 
+def save(options, source_graph, coarsening):
+    """
+    Write the outputs of a run for each level of the hierarchy of coarsening.
+    """
+
+    import numpy
+
+    from models.uncoarsening import Uncoarsening
+
+    output = options.output
+    uncoarsening = Uncoarsening(source_graph, coarsening.hierarchy_graphs)
+    levels = zip(coarsening.hierarchy_levels, coarsening.hierarchy_graphs, uncoarsening.memberships())
+    for index, obj in enumerate(levels):
+        level, coarsened_graph, (_, membership) = obj
+        index += 1
+
+        if options.save_conf or options.show_conf:
+            d = {
+                'source_input': options.input
+                , 'source_vertices': source_graph['vertices']
+                , 'source_vcount': source_graph.vcount()
+                , 'source_ecount': source_graph.ecount()
+                , 'coarsened_ecount': coarsened_graph.ecount()
+                , 'coarsened_vcount': coarsened_graph.vcount()
+                , 'coarsened_vertices': coarsened_graph['vertices']
+                , 'achieved_levels': coarsened_graph['level']
+                , 'reduction_factor': options.reduction_factor
+                , 'max_levels': options.max_levels
+                , 'similarity': options.similarity
+                , 'matching': options.matching
+                , 'upper_bound': options.upper_bound
+                , 'gmv': options.gmv
+                , 'itr': options.itr
+                , 'level': level
+            }
+
+        if options.save_conf:
+            with open(output + '-' + str(index) + '-info.json', 'w+') as f:
+                json.dump(d, f, indent=4)
+
+        if options.show_conf:
+            print(json.dumps(d, indent=4))
+
+        if options.save_ncol:
+            coarsened_graph.write_ncol(output + '-' + str(index) + '.ncol')
+
+        if options.save_source:
+            with open(output + '-' + str(index) + '.source', 'w+') as f:
+                for vertex in range(coarsened_graph.vcount()):
+                    f.write(' '.join(map(str, coarsened_graph.sources(vertex).tolist())) + '\n')
+
+        if options.save_membership:
+            numpy.savetxt(output + '-' + str(index) + '.membership', membership, fmt='%d')
+
+        if options.save_predecessor:
+            with open(output + '-' + str(index) + '.predecessor', 'w+') as f:
+                for vertex in range(coarsened_graph.vcount()):
+                    f.write(' '.join(map(str, coarsened_graph.predecessors(vertex).tolist())) + '\n')
+
+        if options.save_successor:
+            numpy.savetxt(output + '-' + str(index) + '.successor', coarsened_graph.successor, fmt='%d')
+
+        if options.save_weight:
+            numpy.savetxt(output + '-' + str(index) + '.weight', coarsened_graph.weight, fmt='%d')
+
+        if options.save_gml:
+            coarsened_graph.write_gml(output + '-' + str(index) + '.gml')
+
+        if not options.save_hierarchy:
+            break
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -25,8 +25,8 @@ Giving credit to the author by citing the papers.
 """
 
 import argparse
+import copy
 import json
-import yaml
 import os
 
 from datetime import datetime
@@ -41,12 +41,25 @@ __docformat__ = 'markdown en'
 __version__ = '0.1'
 __date__ = '2020-05-05'
 
+# Parsed argument schemas by file name, with the modification time they were read at
+schemas = {}
+
+def load_schema(filename):
+	"""
+	Argument schema of a json file, parsed once per process while the file is
+	unchanged. Only the runs of one process share it, e.g., those of a batch,
+	whose workers receive the schemas parsed by the main process.
+	"""
+
+	mtime = os.path.getmtime(filename)
+	if filename not in schemas or schemas[filename][0] != mtime:
+		with open(filename) as f:
+			schemas[filename] = (mtime, json.load(f))
+	return copy.deepcopy(schemas[filename][1])
+
 def setup_parser(filename):
 
-	with open(filename) as f:
-		args = json.load(f)
-		args = json.dumps(args)
-		args = yaml.safe_load(args)
+	args = load_schema(filename)
 
 	descriptions = 'description'
 	if 'descriptions' in args:
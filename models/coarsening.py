@@ -33,14 +33,200 @@ __version__ = '0.1'
 __date__ = '2020-05-05'
 
 import sys
+import copy
 import numpy
+import numbers
 import multiprocessing as mp
 
-from models.similarity import Similarity
+from scipy import sparse
+from models.similarity import Similarity, set_cache
+from models.hierarchy import HierarchyStore
+from models.mgraph import MGraph, dominant_labels, offsets, project_factors
+from models.uncoarsening import Uncoarsening
+from models.twohop import TwoHopIndex, concatenate
 
 
-def modified_starmap_async(function, kwargs):
-    return function(**kwargs)
+# Matching methods applied to the one-mode projection of a layer
+PROJECTION_MATCHING = ['hem', 'lem', 'rm', 'mnmf', 'msvm']
+
+# Arguments of weighted_one_mode_projection passed along the kwargs of projection matchers
+PROJECTION_OPTIONS = ['top_k', 'threshold', 'memory_limit', 'directory']
+
+# Multipliers of the suffixes of memory sizes such as 8G
+MEMORY_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# multiprocessing.shared_memory (models.sharedgraph) requires Python 3.8; older
+# versions pickle the graph and the label arrays into each task instead
+SHARED_MEMORY = sys.version_info >= (3, 8)
+
+# Numeric parameters given per layer, those that may be None and the smallest valid values
+INTEGER_PARAMS = [
+    'max_levels', 'itr', 'gmv', 'top_k', 'mlpb_chunk', 'hub_degree', 'mnmf_rank', 'mnmf_itr', 'mnmf_batch'
+]
+REAL_PARAMS = ['reduction_factor', 'upper_bound', 'tolerance']
+OPTIONAL_PARAMS = ['reduction_factor', 'gmv', 'top_k', 'mlpb_chunk', 'hub_degree', 'mnmf_batch']
+MIN_PARAMS = {'top_k': 1, 'mlpb_chunk': 1, 'hub_degree': 0, 'mnmf_rank': 1, 'mnmf_itr': 1, 'mnmf_batch': 1}
+
+# Parameters read only by some matching methods; other layers may leave them as None
+MATCHING_PARAMS = {
+    'itr': ['mlpb'], 'upper_bound': ['mlpb'], 'tolerance': ['mlpb'], 'mlpb_chunk': ['mlpb'],
+    'top_k': ['mlpb', 'gmb', 'ldm', 'rgmb'] + PROJECTION_MATCHING,
+    'mnmf_rank': ['mnmf'], 'mnmf_itr': ['mnmf'], 'mnmf_batch': ['mnmf']
+}
+
+
+def memory_size(value):
+    """ Number of bytes of a memory size given as a number or a string such as 512M or 8G. """
+
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in MEMORY_UNITS else ''
+    return int(float(value[:len(value) - len(unit)]) * MEMORY_UNITS[unit])
+
+
+class Immediate(object):
+    """ Result of a task run in the current process, with the get() interface of AsyncResult. """
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def submit(pool, function, *args):
+    """ Run function in the pool, or right away in the current process if there is no pool. """
+
+    if pool is None:
+        return Immediate(function(*args))
+    return pool.apply_async(function, args)
+
+
+def task_graph(graph):
+    """ Graph of a task: the graph itself, or the shared graph a handle refers to. """
+
+    if isinstance(graph, dict):
+        from models.sharedgraph import attach
+
+        return attach(graph)
+    return graph
+
+
+def matching_task(graph, matching, similarity, projection, layer, kwargs, options):
+    """ Task: match one layer of graph with the given matching method. """
+
+    graph = task_graph(graph)
+    if matching in PROJECTION_MATCHING:
+        kwargs = dict(kwargs)
+        projection_kwargs = {key: kwargs.pop(key) for key in PROJECTION_OPTIONS}
+        graph['projection'] = Similarity(graph, measure=projection, **options)
+        one_mode_graph = graph.weighted_one_mode_projection(
+            graph['vertices_by_type'][layer], similarity=similarity, **projection_kwargs
+        )
+        result = getattr(one_mode_graph, matching)(**kwargs)
+        if matching == 'mnmf':
+            return result, one_mode_graph['factors']
+        return result
+    graph['similarity'] = Similarity(graph, measure=similarity, **options)
+    return getattr(graph, matching)(**kwargs)
+
+
+def gmb_candidates_task(graph, similarity, vertices, reverse, top_k, options):
+    """ Task: gmb candidate pairs of a block of vertices. """
+
+    graph = task_graph(graph)
+    graph['similarity'] = Similarity(graph, measure=similarity, **options)
+    return graph.gmb_candidates(vertices, reverse=reverse, top_k=top_k)
+
+
+def rgmb_pairs_task(graph, similarity, seeds, top_k, options):
+    """ Task: pairs proposed by rgmb for a block of seeds, ignoring the other blocks. """
+
+    graph = task_graph(graph)
+    graph['similarity'] = Similarity(graph, measure=similarity, **options)
+    visited = numpy.zeros(graph.vcount(), dtype=bool)
+    matching = numpy.full(graph.vcount(), -1, dtype=numpy.int64)
+    return graph.rgmb_greedy(seeds, visited, matching, len(seeds), top_k=top_k)
+
+
+def two_hop_task(graph, similarity, vertices, top_k, options):
+    """ Task: arrays of the two-hops index of a block of vertices. """
+
+    graph = task_graph(graph)
+    return TwoHopIndex(Similarity(graph, measure=similarity, **options), vertices, top_k=top_k).arrays()
+
+
+def mlpb_votes_task(handle, rows, max_size):
+    """ Task: dominant labels of the given rows of the index shared by ParallelPropagation. """
+
+    if 'token' in handle:
+        from models.sharedgraph import attach_arrays
+
+        state = attach_arrays(handle)
+    else:
+        state = handle['arrays']
+    index = TwoHopIndex(None, state['vertices'], arrays=(state['indptr'], state['indices'], state['data']))
+    return dominant_labels(index, rows, state['labels'], state['weight_of_sv'], state['vertex_weight'], max_size)
+
+
+class ParallelPropagation(object):
+    """
+    Label propagation of mlpb in chunks run by the workers of a pool: the index is
+    built by blocks of vertices and the dominant labels of each chunk are
+    computed by blocks of rows, all against the labels and super-vertex
+    weights the master publishes in shared memory and updates between
+    chunks. Without shared memory the arrays are sent with each task.
+    """
+
+    def __init__(self, pool, threads, source, similarity, options):
+        self.pool = pool
+        self.threads = threads
+        self.source = source
+        self.similarity = similarity
+        self.options = options
+        self.shared = None
+        self.handle = None
+
+    def two_hop_index(self, vertices, top_k):
+        blocks = numpy.array_split(vertices, self.threads)
+        results = [
+            submit(self.pool, two_hop_task, self.source, self.similarity, block, top_k, self.options)
+            for block in blocks
+        ]
+        return concatenate([TwoHopIndex(None, block, arrays=result.get()) for block, result in zip(blocks, results)])
+
+    def share(self, index, **arrays):
+        """ Publish the index and the arrays; returns the shared copies of the arrays. """
+
+        indptr, indices, data = index.arrays()
+        arrays.update(vertices=index.vertices, indptr=indptr, indices=indices, data=data)
+        if not SHARED_MEMORY:
+            self.handle = {'arrays': arrays}
+            return arrays
+        from models.sharedgraph import SharedArrays
+
+        self.shared = SharedArrays(arrays, group=self.source['group'])
+        self.handle = self.shared.handle
+        return self.shared.arrays
+
+    def votes(self, rows, max_size):
+        blocks = [block for block in numpy.array_split(rows, self.threads) if len(block) > 0]
+        results = [submit(self.pool, mlpb_votes_task, self.handle, block, max_size) for block in blocks]
+        starts = offsets([len(block) for block in blocks])
+        voted, dominant = [], []
+        for start, result in zip(starts, results):
+            block_voted, block_dominant = result.get()
+            voted.append(block_voted + start)
+            dominant.append(block_dominant)
+        if not voted:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        return numpy.concatenate(voted), numpy.concatenate(dominant)
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.unlink()
+            self.shared = None
 
 
 class Coarsening:
@@ -50,63 +236,101 @@ class Coarsening:
         prop_defaults = {
             'reduction_factor': [0.5], 'max_levels': [3], 'matching': ['rgmb'],
             'similarity': ['common_neighbors'], 'itr': [10], 'upper_bound': [0.2], 'seed_priority': ['degree'],
-            'gmv': [None], 'tolerance': [0.01], 'reverse': None, 'projection': 'common_neighbors',
-            'pgrd': [0.50], 'deltap': [0.35], 'deltav': [0.35], 'wmin': [0.0], 'wmax': [1.0], 'threads': 1
+            'gmv': [None], 'tolerance': [0.01], 'reverse': ['true'], 'projection': 'common_neighbors',
+            'pgrd': [0.50], 'deltap': [0.35], 'deltav': [0.35], 'wmin': [0.0], 'wmax': [1.0], 'threads': 1,
+            'top_k': [None], 'mlpb_chunk': [None], 'hub_degree': [None], 'hub_sample': False,
+            'similarity_cache': None, 'hierarchy_directory': None, 'projection_threshold': None, 'projection_mem_limit': None,
+            'mnmf_rank': [100], 'mnmf_itr': [200], 'mnmf_batch': [None], 'mnmf_warm_start': False
         }
 
+        # Properties shared by all layers
+        global_props = [
+            'threads', 'projection', 'hub_sample', 'similarity_cache', 'hierarchy_directory', 'projection_threshold',
+            'projection_mem_limit', 'mnmf_warm_start'
+        ]
+
+        unknown = sorted(set(kwargs) - set(prop_defaults))
+        if unknown:
+            raise ValueError('Unknown coarsening parameters: ' + ', '.join(unknown) + '.')
+
         self.__dict__.update(prop_defaults)
         self.__dict__.update(kwargs)
 
         self.source_graph = source_graph
-        self.hierarchy_graphs = []
+        self.hierarchy_graphs = HierarchyStore(self.hierarchy_directory)
         self.hierarchy_levels = []
+        # Factors of the last mnmf of each layer, projected on the current level
+        self.factors = [None] * self.source_graph['layers']
 
-        # Validation of list values
+        # Validation of list values: a scalar or a single value applies to every layer
         for prop_name, prop_value in prop_defaults.items():
-            if prop_name != 'threads' and len(getattr(self, prop_name)) == 1:
-                setattr(self, prop_name, [getattr(self, prop_name)[0]] * self.source_graph['layers'])
+            if prop_name not in global_props:
+                value = getattr(self, prop_name)
+                value = list(value) if isinstance(value, (list, tuple, numpy.ndarray)) else [value]
+                if len(value) == 1:
+                    value = value * self.source_graph['layers']
+                setattr(self, prop_name, value)
 
         # Parameters dimension validation
         for prop_name, prop_value in prop_defaults.items():
-            if prop_name not in ['threads', 'projection']:
+            if prop_name not in global_props:
                 if self.source_graph['layers'] != len(getattr(self, prop_name)):
-                    print('Number of layers and ' + str(prop_name) + ' do not match.')
-                    sys.exit(1)
+                    raise ValueError('Number of layers and ' + str(prop_name) + ' do not match.')
+
+        if isinstance(self.threads, bool) or not isinstance(self.threads, numbers.Integral) or self.threads < 1:
+            raise ValueError('Number of threads ' + repr(self.threads) + ' is invalid.')
+        if self.projection_threshold is not None and (
+                isinstance(self.projection_threshold, bool) or not isinstance(self.projection_threshold, numbers.Real)):
+            raise ValueError('Projection threshold ' + repr(self.projection_threshold) + ' is invalid.')
+        if self.similarity_cache is not None and (
+                isinstance(self.similarity_cache, bool) or not isinstance(self.similarity_cache, numbers.Integral)
+                or self.similarity_cache < 1):
+            raise ValueError('Value ' + repr(self.similarity_cache) + ' of similarity_cache is invalid.')
 
         if self.threads > mp.cpu_count():
             print('Warning: Number of defined threads (' + str(self.threads) + ') '
                   'cannot be greater than the real number of cors (' + str(mp.cpu_count()) + ').\n The number of '
                   'threads was setted as ' + str(mp.cpu_count()))
             self.threads = mp.cpu_count()
-            sys.exit(1)
 
         # Matching method validation
-        valid_matching = ['rgmb', 'gmb', 'mlpb', 'hem', 'lem', 'rm', 'mnmf', 'msvm']
+        valid_matching = ['rgmb', 'gmb', 'ldm', 'mlpb', 'hem', 'lem', 'rm', 'mnmf', 'msvm']
         for index, matching in enumerate(self.matching):
-            matching = matching.lower()
+            matching = str(matching).lower()
             if matching not in valid_matching:
-                print('Matching ' + matching + ' method is invalid.')
-                sys.exit(1)
+                raise ValueError('Matching ' + matching + ' method is invalid.')
             self.matching[index] = matching
 
+        # Parameters type and range validation; max_levels only bounds the layers without gmv
+        for prop_name in INTEGER_PARAMS + REAL_PARAMS:
+            kind = numbers.Integral if prop_name in INTEGER_PARAMS else numbers.Real
+            for layer, value in enumerate(getattr(self, prop_name)):
+                if value is None and (prop_name in OPTIONAL_PARAMS
+                                      or prop_name == 'max_levels' and self.gmv[layer] is not None
+                                      or self.matching[layer] not in MATCHING_PARAMS.get(prop_name, valid_matching)):
+                    continue
+                if isinstance(value, bool) or not isinstance(value, kind) or value < MIN_PARAMS.get(prop_name, value):
+                    raise ValueError('Value ' + repr(value) + ' of ' + prop_name + ' is invalid.')
+
         # Seed priority validation
         valid_seed_priority = ['strength', 'degree', 'random']
         for index, seed_priority in enumerate(self.seed_priority):
-            seed_priority = seed_priority.lower()
+            seed_priority = str(seed_priority).lower()
             if seed_priority not in valid_seed_priority:
-                print('Seed priotiry ' + seed_priority + ' is invalid.')
-                sys.exit(1)
+                raise ValueError('Seed priotiry ' + seed_priority + ' is invalid.')
             self.seed_priority[index] = seed_priority
 
         # Reverse validation
         for index, reverse in enumerate(self.reverse):
+            if isinstance(reverse, bool):
+                continue
+            reverse = str(reverse)
             if reverse.lower() in ('yes', 'true', 't', 'y', '1'):
                 self.reverse[index] = True
             elif reverse.lower() in ('no', 'false', 'f', 'n', '0'):
                 self.reverse[index] = False
             else:
-                print('Boolean value expected in -rv.')
-                sys.exit(1)
+                raise ValueError('Boolean value expected in -rv.')
 
         # Similarity measure validation
         valid_similarity = [
@@ -116,19 +340,31 @@ class Coarsening:
             'hub_depressed', 'leicht_holme_newman', 'newman_collaboration', 'unweight'
         ]
         for index, similarity in enumerate(self.similarity):
-            similarity = similarity.lower()
+            similarity = str(similarity).lower()
             if similarity not in valid_similarity:
-                print('Similarity ' + similarity + ' misure is unvalid.')
-                sys.exit(1)
+                raise ValueError('Similarity ' + similarity + ' misure is unvalid.')
             self.similarity[index] = similarity
 
-        self.projection = self.projection.lower()
+        self.projection = str(self.projection).lower()
         if self.projection not in valid_similarity:
-            print('Projection similarity ' + self.projection + ' misure is unvalid.')
-            sys.exit(1)
+            raise ValueError('Projection similarity ' + self.projection + ' misure is unvalid.')
+
+        if self.projection_mem_limit is not None:
+            try:
+                self.projection_mem_limit = memory_size(self.projection_mem_limit)
+            except ValueError:
+                raise ValueError('Memory size ' + str(self.projection_mem_limit) + ' in -pml is invalid.') from None
+            if self.projection_mem_limit < 0:
+                raise ValueError('Value ' + repr(self.projection_mem_limit) + ' of projection_mem_limit is invalid.')
+            # Blocks are only sparsified by -k and -pth; the whole projection is symmetrized in memory
+            for layer in range(self.source_graph['layers']):
+                if self.matching[layer] in PROJECTION_MATCHING and self.top_k[layer] is None \
+                        and self.projection_threshold is None:
+                    print('Warning: -pml does not bound the memory of the one-mode projection of layer '
+                          + str(layer) + ' without -k or -pth.')
 
         for layer in range(self.source_graph['layers']):
-            if self.matching[layer] in ['rgmb', 'gmb', 'hem', 'lem', 'rm', 'mnmf', 'msvm']:
+            if self.matching[layer] in ['rgmb', 'gmb', 'ldm', 'hem', 'lem', 'rm', 'mnmf', 'msvm']:
                 # if self.gmv[layer] is not None:
                 #     self.gmv[layer] = None
                 #     text = 'Matching method ' + self.matching[layer]
@@ -142,15 +378,42 @@ class Coarsening:
                     text += str(layer) + ') does not accept -rf > 0.5.'
                     print(text)
 
+    def set_hierarchy_directory(self, directory):
+        """ Store the levels of the hierarchy (and spilled projections) in directory from the next run on. """
+
+        self.hierarchy_directory = directory
+        self.hierarchy_graphs = HierarchyStore(directory)
+
     def run(self):
 
+        # Each process scores through its own cache, kept from one run to the next
+        set_cache(self.similarity_cache)
+
+        # A single pool of workers serves every level
+        pool = None
+        if self.threads > 1:
+            if SHARED_MEMORY:
+                from models.sharedgraph import start_tracker
+
+                start_tracker()
+            pool = mp.Pool(processes=self.threads, initializer=set_cache, initargs=(self.similarity_cache,))
+
+        try:
+            self.coarsen(pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def coarsen(self, pool=None):
+
         graph = self.source_graph.copy()
         while True:
 
-            level = graph['level']
+            level = list(graph['level'])
             contract = False
 
-            args = []
+            jobs = []
             for layer in range(graph['layers']):
 
                 do_matching = True
@@ -167,7 +430,13 @@ class Coarsening:
                     kwargs = dict(reduction_factor=self.reduction_factor[layer])
 
                     kwargs['gmv'] = self.gmv[layer]
-                    if self.matching[layer] in ['mlpb', 'gmb', 'rgmb']:
+                    if self.matching[layer] in ['mlpb', 'gmb', 'ldm', 'rgmb'] + PROJECTION_MATCHING:
+                        kwargs['top_k'] = self.top_k[layer]
+                    if self.matching[layer] in PROJECTION_MATCHING:
+                        kwargs['threshold'] = self.projection_threshold
+                        kwargs['memory_limit'] = self.projection_mem_limit
+                        kwargs['directory'] = self.hierarchy_directory
+                    if self.matching[layer] in ['mlpb', 'gmb', 'ldm', 'rgmb']:
                         kwargs['vertices'] = graph['vertices_by_type'][layer]
                         kwargs['reverse'] = self.reverse[layer]
                     if self.matching[layer] in ['mlpb', 'rgmb']:
@@ -177,40 +446,36 @@ class Coarsening:
                         kwargs['n'] = self.source_graph['vertices'][layer]
                         kwargs['tolerance'] = self.tolerance[layer]
                         kwargs['itr'] = self.itr[layer]
+                        kwargs['chunk'] = self.mlpb_chunk[layer]
+                    if self.matching[layer] in ['mnmf']:
+                        kwargs['k'] = self.mnmf_rank[layer]
+                        kwargs['itr'] = self.mnmf_itr[layer]
+                        kwargs['batch_size'] = self.mnmf_batch[layer]
+                        kwargs['init'] = self.factors[layer] if self.mnmf_warm_start else None
 
-                    if self.matching[layer] in ['hem', 'lem', 'rm', 'mnmf', 'msvm']:
-                        graph['projection'] = getattr(Similarity(graph, graph['adjlist']), self.projection)
-                        one_mode_graph = graph.weighted_one_mode_projection(graph['vertices_by_type'][layer], similarity=self.similarity[layer])
-                        matching_function = getattr(one_mode_graph, self.matching[layer])
-                    else:
-                        graph['similarity'] = getattr(Similarity(graph, graph['adjlist']), self.similarity[layer])
-                        matching_function = getattr(graph, self.matching[layer])
-
-                    # Create a args for the engine multiprocessing.pool
-                    args.append([(matching_function, kwargs)])
+                    jobs.append((layer, kwargs))
 
             if contract:
 
-                # Create pools
-                pool = mp.Pool(processes=self.threads)
-                processes = []
-                for arg in args:
-                    processes.append(pool.starmap_async(modified_starmap_async, arg))
-
-                # Merge chunked solutions
+                # Merge the solutions of each layer
                 matching = numpy.arange(graph.vcount())
-                for process in processes:
-                    result = process.get()[0]
+                for result in self.match(pool, graph, jobs):
                     vertices = numpy.where(result > -1)[0]
                     matching[vertices] = result[vertices]
 
-                # Close processes
-                pool.close()
-                pool.join()
-
                 # Contract current graph using the matching
                 coarsened_graph = graph.contract(matching)
                 coarsened_graph['level'] = level
+                for layer, kwargs in jobs:
+                    if self.matching[layer] == 'mnmf':
+                        self.factors[layer] = project_factors(
+                            self.factors[layer], graph['vertices_by_type'][layer], graph.successor,
+                            coarsened_graph['vertices_by_type'][layer]
+                        )
+                if len(self.hierarchy_graphs) > 0:
+                    self.hierarchy_graphs.set_successor(len(self.hierarchy_graphs) - 1, graph.successor)
+                else:
+                    self.source_graph.successor = graph.successor
 
                 if coarsened_graph.vcount() == graph.vcount():
                     break
@@ -220,3 +485,147 @@ class Coarsening:
                 graph = coarsened_graph
             else:
                 break
+
+    def similarity_options(self, layer):
+        """ Hub pruning options of the Similarity of a layer. """
+
+        return dict(max_degree=self.hub_degree[layer], sample=self.hub_sample)
+
+    def match(self, pool, graph, jobs):
+        """
+        Match the layers in jobs, a list of (layer, kwargs), and return one
+        matching array per layer. All tasks of all layers are submitted before
+        any result is collected. With a pool, gmb, ldm and rgmb layers are
+        split in blocks of vertices matched by different workers, and the graph
+        is published once in shared memory instead of being pickled per task
+        (from Python 3.8 on).
+        """
+
+        if pool is None or not SHARED_MEMORY:
+            return self.collect(graph, graph, jobs, pool)
+        from models.sharedgraph import SharedGraph
+
+        shared = SharedGraph(graph)
+        try:
+            return self.collect(graph, shared.handle, jobs, pool)
+        finally:
+            shared.unlink()
+
+    def collect(self, graph, source, jobs, pool):
+        """ Submit the tasks of match, which read the graph through source, and gather their results. """
+
+        tasks = []
+        for layer, kwargs in jobs:
+            matching = self.matching[layer]
+            similarity = self.similarity[layer]
+            options = self.similarity_options(layer)
+            if pool is not None and matching in ['gmb', 'ldm']:
+                blocks = numpy.array_split(kwargs['vertices'], self.threads)
+                results = [
+                    submit(pool, gmb_candidates_task, source, similarity, block, kwargs['reverse'], kwargs['top_k'],
+                           options)
+                    for block in blocks
+                ]
+                tasks.append((layer, kwargs, None, results))
+            elif pool is not None and matching == 'rgmb':
+                vertices_id = graph.seed_order(
+                    kwargs['vertices'], seed_priority=kwargs['seed_priority'], reverse=kwargs['reverse']
+                )
+                results = [
+                    submit(pool, rgmb_pairs_task, source, similarity, seeds, kwargs['top_k'], options)
+                    for seeds in (vertices_id[block::self.threads] for block in range(self.threads))
+                ]
+                tasks.append((layer, kwargs, vertices_id, results))
+            elif pool is not None and matching == 'mlpb' and kwargs['chunk'] is not None:
+                # Run by the master once the tasks of the other layers are submitted
+                tasks.append((layer, kwargs, None, None))
+            else:
+                results = [
+                    submit(pool, matching_task, source, matching, similarity, self.projection, layer, kwargs, options)
+                ]
+                tasks.append((layer, kwargs, None, results))
+
+        matchings = []
+        for layer, kwargs, vertices_id, results in tasks:
+            matching = self.matching[layer]
+            options = self.similarity_options(layer)
+            if pool is not None and matching in ['gmb', 'ldm']:
+                candidates = numpy.concatenate([result.get() for result in results])
+                matchings.append(getattr(graph, matching + '_select')(
+                    kwargs['vertices'], candidates, reduction_factor=kwargs['reduction_factor'],
+                    reverse=kwargs['reverse'], gmv=kwargs['gmv']
+                ))
+            elif pool is not None and matching == 'rgmb':
+                pairs = [pair for result in results for pair in result.get()]
+                matchings.append(graph.rgmb_resolve(
+                    kwargs['vertices'], vertices_id, pairs, reduction_factor=kwargs['reduction_factor'],
+                    gmv=kwargs['gmv'], top_k=kwargs['top_k'],
+                    similarity=Similarity(graph, measure=self.similarity[layer], **options)
+                ))
+            elif pool is not None and matching == 'mlpb' and kwargs['chunk'] is not None:
+                propagation = ParallelPropagation(pool, self.threads, source, self.similarity[layer], options)
+                try:
+                    matchings.append(graph.mlpb(propagation=propagation, **kwargs))
+                finally:
+                    propagation.close()
+            elif matching == 'mnmf':
+                result, self.factors[layer] = results[0].get()
+                matchings.append(result)
+            else:
+                matchings.append(results[0].get())
+
+        return matchings
+
+
+def coarsen(graph, vertices=None, **params):
+    """
+    Coarsen a bipartite graph in memory, without reading or writing files.
+    graph is an MGraph, a scipy sparse biadjacency matrix, or an edge list
+    (rows, cols) or (rows, cols, weights) whose vertices are numbered layer by
+    layer, vertices giving the number of vertices of each layer (if given with
+    an MGraph or a matrix, it must match their layers). params are
+    those of Coarsening, where a scalar applies to every layer; invalid values
+    raise ValueError. A given MGraph is not modified.
+
+    Returns one dictionary per coarsened level with its CSR arrays (indptr,
+    indices, data), the type and weight of its vertices, its level and number
+    of vertices per layer, the successor array of the previous level (the
+    vertex of this level each vertex of the previous one is merged into) and
+    the membership of the vertices of the source graph.
+    """
+
+    if isinstance(graph, MGraph):
+        # Coarsening sets the successor array of its source graph; the caller's graph is left untouched
+        source_graph = copy.copy(graph)
+        source_graph.attributes = dict(graph.attributes)
+    elif sparse.issparse(graph):
+        source_graph = MGraph()
+        source_graph.from_biadjacency(graph)
+    else:
+        if vertices is None:
+            raise ValueError('Vertices are required when an edge list is given.')
+        rows, cols, weights = (tuple(graph) + (None,))[:3]
+        rows, cols = numpy.asarray(rows), numpy.asarray(cols)
+        if len(rows) != len(cols) or (weights is not None and len(weights) != len(rows)):
+            raise ValueError('Edge arrays must have the same length.')
+        if len(rows) and (min(rows.min(), cols.min()) < 0 or max(rows.max(), cols.max()) >= sum(vertices)):
+            raise ValueError('Edge endpoints must be vertices between 0 and sum(vertices) - 1.')
+        source_graph = MGraph()
+        source_graph.from_edges(rows, cols, weights, vertices)
+    if vertices is not None and list(vertices) != list(source_graph['vertices']):
+        raise ValueError('Value ' + repr(vertices) + ' of vertices is invalid.')
+
+    coarsening = Coarsening(source_graph, **params)
+    coarsening.run()
+
+    levels = []
+    uncoarsening = Uncoarsening(source_graph, coarsening.hierarchy_graphs)
+    for (index, membership), level in zip(uncoarsening.memberships(), coarsening.hierarchy_levels):
+        coarsened_graph = uncoarsening.graph(index)
+        levels.append({
+            'level': level, 'vertices': coarsened_graph['vertices'], 'indptr': coarsened_graph.indptr,
+            'indices': coarsened_graph.indices, 'data': coarsened_graph.data, 'type': coarsened_graph.type,
+            'weight': coarsened_graph.weight, 'successor': uncoarsening.successor(index - 1),
+            'membership': membership
+        })
+    return levels
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hierarchy store
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program comes with ABSOLUTELY NO WARRANTY. THE ENTIRE RISK AS TO THE QUALITY AND PERFORMANCE OF THE PROGRAM IS
+WITH YOU.
+
+Owner or contributors are not liable for any direct, indirect, incidental, special, exemplary, or consequential
+damages, (such as loss of data or profits, and others) arising in any way out of the use of this software,
+even if advised of the possibility of such damage.
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+
+Giving credit to the author by citing the papers.
+"""
+
+__maintainer__ = 'Alan Valejo'
+__email__ = 'alanvalejo@gmail.com'
+__author__ = 'Alan Valejo'
+__credits__ = ['Alan Valejo']
+__homepage__ = 'https://www.alanvalejo.com.br'
+__license__ = 'GNU.GPL.v3'
+__docformat__ = 'markdown en'
+__version__ = '0.1'
+__date__ = '2020-05-05'
+
+import os
+import json
+import numpy
+
+from models.mgraph import MGraph
+
+# Arrays of a MGraph written for each level
+LEVEL_ARRAYS = [
+    'indptr', 'indices', 'data', 'type', 'weight', 'name', 'successor',
+    'source_ptr', 'source', 'predecessor_ptr', 'predecessor'
+]
+
+# Graph attributes written for each level
+LEVEL_ATTRIBUTES = ['layers', 'vertices', 'level']
+
+
+class HierarchyStore(object):
+    """
+    Sequence of the coarsened graphs of a hierarchy.
+
+    Without a directory the graphs are kept in memory. With a directory, the
+    arrays of each level are written to .npy files as soon as the level is
+    appended and graphs are read back lazily, memory-mapped, when indexed;
+    only the graph being coarsened has to be resident.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.graphs = []
+        self.count = 0
+        if self.directory is not None and not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def level_directory(self, index):
+        return os.path.join(self.directory, 'level-' + str(index))
+
+    def append(self, graph):
+        """ Add the next (coarser) level of the hierarchy. """
+
+        if self.directory is None:
+            self.graphs.append(graph)
+        else:
+            path = self.level_directory(self.count)
+            if not os.path.exists(path):
+                os.makedirs(path)
+            for name in LEVEL_ARRAYS:
+                numpy.save(os.path.join(path, name + '.npy'), getattr(graph, name))
+            attributes = {key: graph[key] for key in LEVEL_ATTRIBUTES if key in graph}
+            with open(os.path.join(path, 'attributes.json'), 'w+') as f:
+                json.dump(attributes, f, default=int)
+        self.count += 1
+
+    def set_successor(self, index, successor):
+        """ Store the successor array of a level, known once the next level is contracted. """
+
+        if self.directory is None:
+            self.graphs[index].successor = successor
+        else:
+            numpy.save(os.path.join(self.level_directory(index), 'successor.npy'), successor)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError('Hierarchy level out of range.')
+        if self.directory is None:
+            return self.graphs[index]
+
+        path = self.level_directory(index)
+        graph = MGraph()
+        for name in LEVEL_ARRAYS:
+            setattr(graph, name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        with open(os.path.join(path, 'attributes.json')) as f:
+            graph.attributes = json.load(f)
+        graph['similarity'] = None
+        graph['vertices_by_type'] = []
+        for layer in range(graph['layers']):
+            graph['vertices_by_type'].append(numpy.flatnonzero(graph.type == layer))
+        return graph
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
@@ -22,27 +22,20 @@ see http://www.gnu.org/licenses/.
 Giving credit to the author by citing the papers.
 """
 
-import operator
 
+import os
 import numpy
-import random
 import math
-import collections
 
-from random import sample
-from igraph import Graph
 from scipy import sparse
-from numpy import dot
 from numpy.linalg import norm
-from numpy import linalg as LA
 from models.similarity import Similarity
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy import spatial
-from sklearn.decomposition import non_negative_factorization
-# from sklearn.decomposition import ProjectedGradientNMF
-from sklearn.decomposition import NMF
+from models.twohop import TwoHopIndex, unique_pairs
 import warnings
 
+# scikit-learn (mnmf) and scipy.sparse.csgraph are imported by the methods
+# that use them, which keeps them out of the startup of every run
+
 __maintainer__ = 'Alan Valejo'
 __email__ = 'alanvalejo@gmail.com'
 __author__ = 'Alan Valejo'
@@ -53,246 +46,861 @@ __docformat__ = 'markdown en'
 __version__ = '0.1'
 __date__ = '2020-05-05'
 
-def load_ncol(filename):
+# Size in bytes of the blocks read by the streaming ncol reader
+NCOL_CHUNK_SIZE = 1 << 26
+
+# Version of the binary edge cache layout; caches of other versions are ignored
+NCOL_CACHE_VERSION = 1
+
+# Number of vertices whose labels the sequential sweep of mlpb first computes ahead, and the most it ever does
+MLPB_WINDOW = 64
+MLPB_MAX_WINDOW = 4096
+
+# Number of edges scored at once by mnmf and msvm
+EDGE_CHUNK_SIZE = 1 << 16
+
+# Least fraction of the free edges a round of greedy_matching must drop to go on with rounds
+GREEDY_MIN_PROGRESS = 0.1
+
+
+def read_ncol_chunks(filename, chunk_size=NCOL_CHUNK_SIZE):
+    """
+    Stream an ncol file in blocks of about chunk_size bytes, cut at line
+    boundaries, and yield the (rows, cols, weights) arrays of each block.
+    """
+
+    columns = None
+    remainder = b''
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            if block:
+                block = remainder + block
+                cut = block.rfind(b'\n') + 1
+                chunk, remainder = block[:cut], block[cut:]
+            else:
+                chunk, remainder = remainder, b''
+            if chunk.strip():
+                if columns is None:
+                    first = next(line for line in chunk.splitlines() if line.strip())
+                    columns = len(first.split())
+                    if columns not in (2, 3):
+                        raise ValueError('Ncol file ' + filename + ' must have two or three columns.')
+                values = numpy.fromstring(chunk, sep=' ')
+                if len(values) % columns != 0:
+                    raise ValueError('Ncol file ' + filename + ' has rows with different number of columns.')
+                values = values.reshape(-1, columns)
+                if columns == 3:
+                    weights = values[:, 2].copy()
+                else:
+                    weights = numpy.ones(len(values))
+                yield values[:, 0].astype(numpy.int64), values[:, 1].astype(numpy.int64), weights
+            if not block:
+                break
+
+
+def coalesce_edges(rows, cols, weights):
+    """
+    Remove repeated (row, col) pairs with a sort-based pass; as in a
+    dictionary keyed by the pair, the last weight read is kept.
+    """
+
+    if len(rows) == 0:
+        return rows, cols, weights
+    keys = rows * (int(cols.max()) + 1) + cols
+    _, index = numpy.unique(keys[::-1], return_index=True)
+    index = numpy.sort(len(keys) - 1 - index)
+    return rows[index], cols[index], weights[index]
+
+
+def ncol_cache_filename(filename):
+    return filename + '.cache.npz'
+
+
+def read_ncol_cache(filename):
+    """
+    Load the binary edge cache of an ncol file, or None if it does not exist
+    or it is out of date with respect to the file mtime and size.
+    """
+
+    cache_filename = ncol_cache_filename(filename)
+    if not os.path.isfile(cache_filename):
+        return None
+    stat = os.stat(filename)
+    try:
+        with numpy.load(cache_filename) as cache:
+            if int(cache['version']) != NCOL_CACHE_VERSION or int(cache['mtime']) != stat.st_mtime_ns \
+                    or int(cache['size']) != stat.st_size:
+                return None
+            return cache['rows'], cache['cols'], cache['weights']
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def write_ncol_cache(filename, rows, cols, weights):
+    """
+    Write the binary edge cache of an ncol file next to it. The cache is
+    skipped, silently, if the directory is not writable.
+    """
+
+    stat = os.stat(filename)
+    dtype = numpy.int32 if max(rows.max(initial=0), cols.max(initial=0)) < numpy.iinfo(numpy.int32).max \
+        else numpy.int64
+    cache_filename = ncol_cache_filename(filename)
+    try:
+        with open(cache_filename + '.tmp', 'wb') as f:
+            numpy.savez(
+                f, version=NCOL_CACHE_VERSION, mtime=stat.st_mtime_ns, size=stat.st_size,
+                rows=rows.astype(dtype), cols=cols.astype(dtype), weights=weights
+            )
+        os.replace(cache_filename + '.tmp', cache_filename)
+    except OSError:
+        pass
+
+
+def load_ncol(filename, cache=True, chunk_size=NCOL_CHUNK_SIZE):
     """
     Load ncol npartite graph and generate special attributes
     """
 
-    data = numpy.loadtxt(filename, skiprows=0, dtype=str)
-    dict_edges = dict()
-    for row in data:
-        if len(row) == 3:
-            dict_edges[(int(row[0]), int(row[1]))] = float(row[2])
-        else:
-            dict_edges[(int(row[0]), int(row[1]))] = 1
+    if cache:
+        edges = read_ncol_cache(filename)
+        if edges is not None:
+            return edges
+
+    rows, cols, weights = [], [], []
+    for chunk_rows, chunk_cols, chunk_weights in read_ncol_chunks(filename, chunk_size):
+        rows.append(chunk_rows)
+        cols.append(chunk_cols)
+        weights.append(chunk_weights)
+    if rows:
+        rows, cols, weights = numpy.concatenate(rows), numpy.concatenate(cols), numpy.concatenate(weights)
+    else:
+        rows, cols, weights = numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+    rows, cols, weights = coalesce_edges(rows, cols, weights)
 
-    edges, weights = list(zip(*dict_edges.items()))
-    return edges, weights
+    if cache:
+        write_ncol_cache(filename, rows, cols, weights)
+    return rows, cols, weights
 
 
-class MGraph(Graph):
+def get_merge_count(size, reduction_factor, gmv=None):
+    """
+    Number of merges a matching performs in a set of size vertices, lowering
+    the reduction factor if needed to keep at least gmv vertices.
+    """
+
+    merge_count = int(reduction_factor * size)
+    if gmv is not None:
+        while True:
+            if size - merge_count >= gmv or reduction_factor <= 0.0:
+                break
+            reduction_factor -= 0.01
+            merge_count = int(reduction_factor * size)
+    return merge_count
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
 
-    def load(self, network_filename, vertices, filename_type='ncol', type_filename=None):
+def csr_from_edges(vcount, rows, cols, weights):
+    """
+    Build the symmetric CSR arrays (indptr, indices, data) of an undirected
+    graph from its edge list. Parallel edges are coalesced by summing weights.
+    """
+
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    cols = numpy.asarray(cols, dtype=numpy.int64)
+    weights = numpy.asarray(weights, dtype=numpy.float64)
+    # Self-loops are stored once
+    mirror = rows != cols
+    matrix = sparse.coo_matrix(
+        (numpy.concatenate([weights, weights[mirror]]),
+         (numpy.concatenate([rows, cols[mirror]]), numpy.concatenate([cols, rows[mirror]]))),
+        shape=(vcount, vcount)
+    ).tocsr()
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    return matrix.indptr.astype(numpy.int64), matrix.indices.astype(numpy.int32), matrix.data
+
+
+def pair_priority(rows, cols, seed=0):
+    """
+    Pseudo-random priority of each pair (rows[e], cols[e]): a 64-bit hash
+    (splitmix64 finalizer) of its ends and seed, so the same pair gets the
+    same priority whatever the order or the blocks the pairs come in.
+    """
+
+    with numpy.errstate(over='ignore'):
+        x = (rows.astype(numpy.uint64) << numpy.uint64(32)) ^ cols.astype(numpy.uint64)
+        x ^= numpy.uint64(seed) * numpy.uint64(0x9E3779B97F4A7C15)
+        x ^= x >> numpy.uint64(30)
+        x *= numpy.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> numpy.uint64(27)
+        x *= numpy.uint64(0x94D049BB133111EB)
+        x ^= x >> numpy.uint64(31)
+    return x
+
+
+def dominant_matching(edge_rows, edge_cols, scores, vcount, merge_count, seed=0):
+    """
+    Matching by synchronous rounds of handshakes: every free vertex points to
+    its best free neighbor (highest score, then lowest pair_priority), pairs
+    pointing to each other are matched and their edges dropped. Each round is
+    a reduction per vertex, with no ordering of the edges. Ties are broken
+    by hashed priorities rather than by position, so a chain of equal scores
+    is not matched one pair per round. If a round would exceed merge_count,
+    its best pairs are kept. Returns the indices of the matched edges.
+    """
+
+    # Edges ranked by score, then priority (then index, on hash collisions);
+    # each vertex points to its free edge of lowest rank
+    edges = numpy.arange(len(edge_rows))
+    order = numpy.lexsort((edges, pair_priority(edge_rows, edge_cols, seed), -scores))
+    rank = numpy.empty(len(edge_rows), dtype=numpy.int64)
+    rank[order] = edges
+    rows, cols = edge_rows, edge_cols
+    free = numpy.ones(vcount, dtype=bool)
+    accepted = []
+    while len(edges) > 0 and merge_count > 0:
+        first = numpy.full(vcount, len(edge_rows), dtype=numpy.int64)
+        numpy.minimum.at(first, rows, rank)
+        numpy.minimum.at(first, cols, rank)
+        dominant = numpy.flatnonzero((first[rows] == rank) & (first[cols] == rank))
+        if len(dominant) > merge_count:
+            dominant = dominant[numpy.argsort(rank[dominant])[:merge_count]]
+        accepted.append(edges[dominant])
+        merge_count -= len(dominant)
+        free[rows[dominant]] = False
+        free[cols[dominant]] = False
+        remaining = free[rows] & free[cols]
+        edges, rows, cols, rank = edges[remaining], rows[remaining], cols[remaining], rank[remaining]
+
+    return numpy.sort(numpy.concatenate(accepted + [numpy.zeros(0, dtype=numpy.int64)]))
+
+
+def project_factors(factors, vertices, successor, coarse_vertices):
+    """
+    Factors (W, H) of the one-mode projection of coarse_vertices from those
+    of the projection of vertices, whose row i of W and column i of H belong
+    to vertices[i]: each coarse vertex gets the mean of the factors of the
+    vertices merged into it (see successor). Used to warm-start mnmf.
+    """
+
+    W, H = factors
+    targets = numpy.searchsorted(coarse_vertices, successor[vertices])
+    counts = numpy.bincount(targets, minlength=len(coarse_vertices))
+    mean = sparse.csr_matrix(
+        (1.0 / counts[targets], (targets, numpy.arange(len(vertices)))), shape=(len(coarse_vertices), len(vertices))
+    )
+    return mean.dot(W), mean.dot(H.T).T
+
+
+def greedy_matching(edge_rows, edge_cols, order, vcount, merge_count):
+    """
+    Edges (edge_rows[e], edge_cols[e]) accepted by the greedy pass over the
+    edges in the given order, which accepts an edge if both its ends are
+    still free, stopping after merge_count edges. Returns their ends in
+    acceptance order.
+
+    Computed in rounds over edge arrays: an edge ranked first among the free
+    edges of both its ends (locally dominant) is accepted by the greedy pass,
+    so every round accepts all of them at once and drops the edges they
+    cover. The greedy pass cut at merge_count keeps the first accepted edges;
+    rounds stop once merge_count edges are accepted ahead of every free edge.
+    On chains of edges ranked one after the other (e.g., tied weights) a
+    round settles only a few edges, so once a round drops less than
+    GREEDY_MIN_PROGRESS of the free edges, the sequential pass settles the
+    remaining ones.
+    """
+
+    # Edges in greedy order: the rank of an edge is its position
+    rows, cols = edge_rows[order], edge_cols[order]
+    rank = numpy.arange(len(order))
+    free = numpy.ones(vcount, dtype=bool)
+    taken = numpy.zeros(len(order), dtype=bool)
+    # Number of edges accepted ahead of the first free edge, ranked first
+    count = 0
+    first = 0
+    while len(rank) > 0 and count < merge_count:
+        best = numpy.full(vcount, len(order), dtype=numpy.int64)
+        numpy.minimum.at(best, rows, rank)
+        numpy.minimum.at(best, cols, rank)
+        dominant = (best[rows] == rank) & (best[cols] == rank)
+        taken[rank[dominant]] = True
+        free[rows[dominant]] = False
+        free[cols[dominant]] = False
+        remaining = free[rows] & free[cols]
+        dropped = len(rank) - numpy.count_nonzero(remaining)
+        rows, cols, rank = rows[remaining], cols[remaining], rank[remaining]
+        if len(rank) > 0:
+            count += numpy.count_nonzero(taken[first:rank[0]])
+            first = rank[0]
+            if dropped < GREEDY_MIN_PROGRESS * (dropped + len(rank)):
+                break
+
+    if len(rank) > 0 and count < merge_count:
+        # Sequential pass over the free edges, whose ends no accepted edge covers
+        accepted_before = numpy.cumsum(taken) - taken
+        sequential = 0
+        for position, vertex, neighbor in zip(rank.tolist(), rows.tolist(), cols.tolist()):
+            if accepted_before[position] + sequential >= merge_count:
+                break
+            if free[vertex] and free[neighbor]:
+                taken[position] = True
+                free[vertex] = False
+                free[neighbor] = False
+                sequential += 1
+
+    accepted = numpy.flatnonzero(taken)[:merge_count]
+    return edge_rows[order[accepted]], edge_cols[order[accepted]]
+
+
+def visit_matching(edge_rows, edge_cols, scores, rank, merge_count):
+    """
+    Pairs matched by visiting the vertices in the order given by rank (the
+    position of each vertex): each free vertex, in turn, is matched with its
+    free neighbor of highest score, the first one on ties, or with itself if
+    no free neighbor has a positive score, stopping after merge_count visits.
+    Edges are given in both directions with symmetric scores. Returns the
+    visited vertices and their neighbors (the vertex itself when matched
+    alone) in visiting order.
+
+    Computed in rounds over edge arrays: a free vertex visited before every
+    free vertex next to it or to its best neighbor cannot be affected by any
+    vertex visited earlier, so every round matches all of them at once, and
+    a free vertex without free edges is matched alone when visited. Once a
+    round drops less than GREEDY_MIN_PROGRESS of the free edges, the
+    remaining vertices are visited one at a time.
+    """
+
+    vcount = len(rank)
+    keep = (scores > 0.0) & (edge_rows != edge_cols)
+    rows, cols, scores = edge_rows[keep], edge_cols[keep], scores[keep]
+    visiting = numpy.empty(vcount, dtype=numpy.int64)
+    visiting[rank] = numpy.arange(vcount)
+    free = numpy.ones(vcount, dtype=bool)
+    # Neighbor matched with the vertex visited at each position
+    partner = numpy.full(vcount, -1, dtype=numpy.int64)
+    while len(rows) > 0:
+        best = numpy.full(vcount, -numpy.inf)
+        numpy.maximum.at(best, rows, scores)
+        tie = scores == best[rows]
+        candidate = numpy.full(vcount, vcount, dtype=numpy.int64)
+        numpy.minimum.at(candidate, rows[tie], cols[tie])
+        earliest = rank.copy()
+        numpy.minimum.at(earliest, rows, rank[cols])
+        vertices = numpy.flatnonzero(candidate < vcount)
+        neighbors = candidate[vertices]
+        ready = (rank[vertices] <= earliest[vertices]) & (rank[vertices] <= earliest[neighbors])
+        vertices, neighbors = vertices[ready], neighbors[ready]
+        partner[rank[vertices]] = neighbors
+        free[vertices] = False
+        free[neighbors] = False
+        remaining = free[rows] & free[cols]
+        dropped = len(rows) - numpy.count_nonzero(remaining)
+        rows, cols, scores = rows[remaining], cols[remaining], scores[remaining]
+        if len(rows) > 0:
+            # Visits settled ahead of the first free vertex with free edges: pairs,
+            # and free vertices without free edges, matched alone
+            start = rank[rows].min()
+            settled = numpy.count_nonzero(partner[:start] >= 0) + numpy.count_nonzero(free[visiting[:start]])
+            if settled >= merge_count or dropped < GREEDY_MIN_PROGRESS * (dropped + len(rows)):
+                break
+
+    if len(rows) > 0:
+        # Sequential visit of the vertices with free edges, each scanning its
+        # free edges from the best one
+        order = numpy.lexsort((cols, -scores, rank[rows]))
+        rows, cols = rows[order], cols[order]
+        starts = numpy.flatnonzero(numpy.r_[True, rows[1:] != rows[:-1]])
+        ends = numpy.r_[starts[1:], len(rows)]
+        alone = free.copy()
+        alone[rows] = False
+        settled = (partner >= 0) | alone[visiting]
+        settled_before = numpy.cumsum(settled) - settled
+        sequential = 0
+        neighbors = cols.tolist()
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            vertex = int(rows[start])
+            if settled_before[rank[vertex]] + sequential >= merge_count:
+                break
+            if not free[vertex]:
+                continue
+            partner[rank[vertex]] = vertex
+            for neighbor in neighbors[start:end]:
+                if free[neighbor]:
+                    partner[rank[vertex]] = neighbor
+                    break
+            free[vertex] = False
+            free[partner[rank[vertex]]] = False
+            sequential += 1
+
+    # Vertices still free are matched alone when visited
+    partner[rank[free]] = numpy.flatnonzero(free)
+    positions = numpy.flatnonzero(partner >= 0)[:merge_count]
+    return visiting[positions], partner[positions]
+
+
+def offsets(lengths):
+    """ Offset table (as in CSR indptr) of consecutive groups with the given lengths. """
+
+    ptr = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=ptr[1:])
+    return ptr
+
+
+def dominant_labels(index, rows, labels, weight_of_sv, vertex_weight, max_size):
+    """
+    Label propagation step of mlpb for the vertices of the given rows of a
+    TwoHopIndex, all computed against the same labels and super-vertex
+    weights. A two-hopes neighbor votes for its label with its similarity if
+    the vertex fits in that super-vertex (weight at most max_size); each
+    vertex takes the label with the highest vote, the first one found on
+    ties. Returns the positions in rows that got a vote, in increasing order,
+    and their dominant labels.
+    """
+
+    indptr, indices, data = index.arrays()
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    ptr = offsets(lengths)
+    positions = numpy.arange(ptr[-1]) - numpy.repeat(ptr[:-1] - starts, lengths)
+    owner = numpy.repeat(numpy.arange(len(rows)), lengths)
+    label = labels[indices[positions]]
+    similarity = data[positions]
+    weight = vertex_weight[index.vertices[rows]][owner]
+    admissible = (weight_of_sv[label] + weight <= max_size) & (similarity > 0.0)
+    owner, label, similarity = owner[admissible], label[admissible], similarity[admissible]
+    if len(owner) == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+    # Votes per (vertex, label), summed in neighbor order; groups are numbered
+    # in order of first appearance
+    keys = owner * len(labels) + label
+    _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+    appearance = numpy.argsort(first, kind='stable')
+    group = numpy.empty(len(first), dtype=numpy.int64)
+    group[appearance] = numpy.arange(len(first))
+    inverse = group[inverse.ravel()]
+    first = first[appearance]
+    votes = numpy.bincount(inverse, weights=similarity)
+    group_owner = owner[first]
+    group_label = label[first]
+
+    # Each label is scored against the votes for all the others
+    total = numpy.bincount(group_owner, weights=votes, minlength=len(rows))
+    votes -= total[group_owner] - votes
+
+    order = numpy.lexsort((numpy.arange(len(votes)), -votes, group_owner))
+    best = order[numpy.r_[True, group_owner[order][1:] != group_owner[order][:-1]]]
+    return group_owner[best], group_label[best]
+
+
+class MGraph(object):
+    """
+    Array-backed n-partite graph.
+
+    Edges are stored in compressed sparse row (CSR) format: the neighbors of
+    vertex v are indices[indptr[v]:indptr[v + 1]] and the weights of these
+    edges are data[indptr[v]:indptr[v + 1]]. Each undirected edge is stored
+    in both rows. Vertex attributes are flat arrays (type, weight, name,
+    successor) and the source and predecessor sets of the super-vertices are
+    stored as flat arrays with offset tables, e.g., the source vertices of v
+    are source[source_ptr[v]:source_ptr[v + 1]]. Graph attributes are
+    accessed as in igraph, e.g., graph['layers'].
+    """
+
+    def __init__(self, vcount=0):
+        self.indptr = numpy.zeros(vcount + 1, dtype=numpy.int64)
+        self.indices = numpy.zeros(0, dtype=numpy.int32)
+        self.data = numpy.zeros(0, dtype=numpy.float64)
+        self.type = numpy.zeros(vcount, dtype=numpy.int32)
+        self.weight = numpy.ones(vcount, dtype=numpy.int32)
+        self.name = numpy.arange(vcount, dtype=numpy.int64)
+        self.successor = numpy.full(vcount, -1, dtype=numpy.int64)
+        self.source_ptr = numpy.arange(vcount + 1, dtype=numpy.int64)
+        self.source = numpy.arange(vcount, dtype=numpy.int64)
+        self.predecessor_ptr = numpy.arange(vcount + 1, dtype=numpy.int64)
+        self.predecessor = numpy.arange(vcount, dtype=numpy.int64)
+        self.attributes = dict()
+
+    def __getitem__(self, key):
+        """ Graph attribute or, given a pair of vertices, the weight of the edge between them. """
+
+        if isinstance(key, tuple):
+            u, v = key
+            start, end = self.indptr[u], self.indptr[u + 1]
+            index = start + numpy.searchsorted(self.indices[start:end], v)
+            if index < end and self.indices[index] == v:
+                return self.data[index]
+            return 0.0
+        return self.attributes[key]
+
+    def __setitem__(self, key, value):
+        self.attributes[key] = value
+
+    def __delitem__(self, key):
+        del self.attributes[key]
+
+    def __contains__(self, key):
+        return key in self.attributes
+
+    def vcount(self):
+        return len(self.indptr) - 1
+
+    def ecount(self):
+        return len(self.indices) // 2
+
+    def set_edges(self, rows, cols, weights):
+        """ Replace the edge set of the graph by the given edge list. """
+
+        self.indptr, self.indices, self.data = csr_from_edges(self.vcount(), rows, cols, weights)
+
+    def edges(self):
+        """ Edge list (rows, cols, weights) with each undirected edge listed once, rows < cols. """
+
+        rows = numpy.repeat(numpy.arange(self.vcount(), dtype=numpy.int64), numpy.diff(self.indptr))
+        mask = rows < self.indices
+        return rows[mask], self.indices[mask].astype(numpy.int64), self.data[mask]
+
+    def csr(self):
+        """ Weighted adjacency matrix as a scipy CSR matrix sharing the graph arrays. """
+
+        return sparse.csr_matrix((self.data, self.indices, self.indptr), shape=(self.vcount(), self.vcount()))
+
+    def neighbors(self, vertex):
+        return self.indices[self.indptr[vertex]:self.indptr[vertex + 1]]
+
+    def degree(self, vertices=None):
+        if vertices is None:
+            return numpy.diff(self.indptr)
+        if numpy.isscalar(vertices):
+            return int(self.indptr[vertices + 1] - self.indptr[vertices])
+        vertices = numpy.asarray(vertices)
+        return self.indptr[vertices + 1] - self.indptr[vertices]
+
+    def strength(self, vertices=None, weights=None):
+        if weights is None:
+            return self.degree(vertices)
+        if numpy.isscalar(vertices):
+            return float(self.data[self.indptr[vertices]:self.indptr[vertices + 1]].sum())
+        rows = numpy.repeat(numpy.arange(self.vcount()), numpy.diff(self.indptr))
+        strength = numpy.bincount(rows, weights=self.data, minlength=self.vcount())
+        if vertices is None:
+            return strength
+        if numpy.isscalar(vertices):
+            return float(strength[vertices])
+        return strength[vertices]
+
+    def sources(self, vertex):
+        return self.source[self.source_ptr[vertex]:self.source_ptr[vertex + 1]]
+
+    def predecessors(self, vertex):
+        return self.predecessor[self.predecessor_ptr[vertex]:self.predecessor_ptr[vertex + 1]]
+
+    def copy(self):
+        graph = MGraph()
+        for key, value in self.__dict__.items():
+            if isinstance(value, numpy.ndarray):
+                setattr(graph, key, value.copy())
+        graph.attributes = {
+            key: (list(value) if isinstance(value, list) else value) for key, value in self.attributes.items()
+        }
+        return graph
+
+    def to_igraph(self):
+        """ Convert to an igraph object with the usual vertex and edge attributes. """
+
+        from igraph import Graph
+
+        graph = Graph(n=self.vcount())
+        rows, cols, weights = self.edges()
+        graph.add_edges(list(zip(rows.tolist(), cols.tolist())))
+        graph.es['weight'] = weights.tolist()
+        graph.vs['type'] = self.type.tolist()
+        graph.vs['weight'] = self.weight.tolist()
+        graph.vs['name'] = self.name.tolist()
+        graph.vs['successor'] = [None if successor < 0 else successor for successor in self.successor.tolist()]
+        graph.vs['source'] = numpy.split(self.source, self.source_ptr[1:-1])
+        graph.vs['predecessor'] = numpy.split(self.predecessor, self.predecessor_ptr[1:-1])
+        for key in ['layers', 'vertices', 'level']:
+            if key in self.attributes:
+                graph[key] = self.attributes[key]
+        return graph
+
+    def write_ncol(self, filename):
+        rows, cols, weights = self.edges()
+        with open(filename, 'w+') as f:
+            for row, col, weight in zip(rows.tolist(), cols.tolist(), weights.tolist()):
+                f.write('%d %d %.15g\n' % (row, col, weight))
+
+    def write_gml(self, filename):
+        graph = self.to_igraph()
+        graph['layers'] = str(self['layers'])
+        graph['vertices'] = ','.join(map(str, self['vertices']))
+        graph['level'] = ','.join(map(str, self['level']))
+        graph.vs['name'] = list(map(str, range(self.vcount())))
+        graph.vs['type'] = list(map(str, self.type.tolist()))
+        graph.vs['weight'] = list(map(str, self.weight.tolist()))
+        graph.vs['successor'] = list(map(str, self.successor.tolist()))
+        graph.vs['source'] = [','.join(map(str, source)) for source in graph.vs['source']]
+        graph.vs['predecessor'] = [','.join(map(str, predecessor)) for predecessor in graph.vs['predecessor']]
+        graph.write(filename, format='gml')
+
+    def load(self, network_filename, vertices, filename_type='ncol', type_filename=None, cache=True):
         """
         filename_type: ncol, arff
+        cache: read and write a binary edge cache next to the input file
         """
 
-        edges, weights = None, None
+        rows, cols, weights = None, None, None
         if filename_type == 'ncol':
-            edges, weights = load_ncol(network_filename)
+            rows, cols, weights = load_ncol(network_filename, cache=cache)
 
-        self.add_vertices(sum(vertices))
-        self.add_edges(edges)
-        self['adjlist'] = list(map(set, self.get_adjlist()))
-        self['vertices'] = vertices
+        self.from_edges(rows, cols, weights, vertices)
+
+    def from_edges(self, rows, cols, weights, vertices):
+        """
+        Build the graph from an edge list whose vertices are numbered layer by
+        layer, vertices[layer] being the number of vertices of each layer.
+        """
+
+        if weights is None:
+            weights = numpy.ones(len(rows))
+        self.__init__(sum(vertices))
+        self.set_edges(rows, cols, weights)
+        self['vertices'] = list(vertices)
         self['layers'] = len(vertices)
         self['level'] = [0] * self['layers']
         self['similarity'] = None
-        self.es['weight'] = weights
-        types = []
-        for layer in range(self['layers']):
-            types += [layer] * vertices[layer]
-        self.vs['type'] = types
-        for v in self.vs():
-            v['weight'] = 1
-            v['source'] = [v.index]
-            v['name'] = [v.index]
-            v['predecessor'] = [v.index]
-            v['successor'] = [None]
+        self.type = numpy.repeat(numpy.arange(self['layers'], dtype=numpy.int32), vertices)
 
         self['vertices_by_type'] = []
         for layer in range(self['layers']):
-            self['vertices_by_type'].append(self.vs.select(type=layer).indices)
+            self['vertices_by_type'].append(numpy.flatnonzero(self.type == layer))
 
-        # Not allow direct graphs
-        if self.is_directed():
-            self.to_undirected(combine_edges=None)
+    def from_biadjacency(self, matrix):
+        """
+        Build the graph from a biadjacency matrix: rows are the vertices of the
+        first layer and columns those of the second.
+        """
+
+        matrix = sparse.coo_matrix(matrix)
+        self.from_edges(matrix.row, matrix.col + matrix.shape[0], matrix.data, list(matrix.shape))
 
     def contract(self, matching):
         """
         Create coarse graph from matching of groups
         """
 
-        # Contract vertices: Referencing the original graph of the coarse graph
+        # Contract vertices: each group of matched vertices becomes a super-vertex,
+        # numbered consecutively layer by layer
+        matching = numpy.asarray(matching)
+        successor = numpy.empty(self.vcount(), dtype=numpy.int64)
         types = []
-        weights = []
-        sources = []
-        predecessors = []
-        matching = numpy.array(matching)
         uniqid = 0
         for layer in range(self['layers']):
             start = sum(self['vertices'][0:layer])
             end = sum(self['vertices'][0:layer + 1])
-            matching_layer = matching[start:end]
-            vertices_layer = numpy.arange(start, end)
-            clusters = numpy.unique(matching_layer)
-            for cluster_id in clusters:
-                ids = numpy.where(matching_layer == cluster_id)[0]
-                vertices = vertices_layer[ids]
-                weight = 0
-                source = []
-                predecessor = []
-                for vertex in vertices:
-                    self.vs[vertex]['successor'] = uniqid
-                    weight += self.vs[vertex]['weight']
-                    source.extend(self.vs[vertex]['source'])
-                    predecessor.append(vertex)
-                weights.append(weight)
-                types.append(layer)
-                sources.append(source)
-                predecessors.append(predecessor)
-                uniqid += 1
+            clusters, inverse = numpy.unique(matching[start:end], return_inverse=True)
+            successor[start:end] = inverse.ravel() + uniqid
+            types.append(numpy.full(len(clusters), layer, dtype=numpy.int32))
+            uniqid += len(clusters)
+        self.successor = successor
 
         # Create coarsened version
-        coarse = MGraph()
-        coarse.add_vertices(uniqid)
-        coarse.vs['type'] = types
-        coarse.vs['weight'] = weights
-        coarse.vs['name'] = range(coarse.vcount())
-        coarse.vs['successor'] = [None] * coarse.vcount()
-        coarse.vs['source'] = sources
-        coarse.vs['predecessor'] = predecessors
+        coarse = MGraph(uniqid)
+        coarse.type = numpy.concatenate(types)
+        coarse.weight = numpy.bincount(successor, weights=self.weight, minlength=uniqid).astype(numpy.int32)
+
+        # Referencing the original graph of the coarse graph: group predecessors and
+        # their source sets by super-vertex, keeping the original order inside groups
+        coarse.predecessor = numpy.argsort(successor, kind='stable').astype(numpy.int64)
+        coarse.predecessor_ptr = offsets(numpy.bincount(successor, minlength=uniqid))
+        lengths = numpy.diff(self.source_ptr)
+        owner = numpy.repeat(successor, lengths)
+        coarse.source = self.source[numpy.argsort(owner, kind='stable')]
+        coarse.source_ptr = offsets(numpy.bincount(owner, minlength=uniqid))
+
         coarse['layers'] = self['layers']
         coarse['similarity'] = None
         coarse['vertices'] = []
-
         coarse['vertices_by_type'] = []
         for layer in range(self['layers']):
-            coarse['vertices_by_type'].append(coarse.vs.select(type=layer).indices)
+            coarse['vertices_by_type'].append(numpy.flatnonzero(coarse.type == layer))
             coarse['vertices'].append(len(coarse['vertices_by_type'][layer]))
 
-        # Contract edges
-        dict_edges = dict()
-        for edge in self.es():
-            v_successor = self.vs[edge.tuple[0]]['successor']
-            u_successor = self.vs[edge.tuple[1]]['successor']
-
-            # Add edge in coarsened graph
-            if v_successor < u_successor:
-                dict_edges[(v_successor, u_successor)] = dict_edges.get((v_successor, u_successor), 0) + edge['weight']
-            else:
-                dict_edges[(u_successor, v_successor)] = dict_edges.get((u_successor, v_successor), 0) + edge['weight']
-
-        if len(dict_edges) > 0:
-            edges, weights = list(zip(*dict_edges.items()))
-            coarse.add_edges(edges)
-            coarse.es['weight'] = weights
-            coarse['adjlist'] = list(map(set, coarse.get_adjlist()))
+        # Contract edges: relabel endpoints by their successors and sum the
+        # weights of parallel edges
+        rows, cols, weights = self.edges()
+        coarse.set_edges(successor[rows], successor[cols], weights)
 
         return coarse
 
-    def gmb(self, vertices=None, reduction_factor=0.5, reverse=True, gmv=None):
+    def gmb(self, vertices=None, reduction_factor=0.5, reverse=True, gmv=None, top_k=None):
         """
         Matches are restricted between vertices that are not adjacent
         but are only allowed to match with neighbors of its neighbors,
         i.e. two-hopes neighborhood
         """
 
-        matching = numpy.array([-1] * self.vcount())
+        candidates = self.gmb_candidates(vertices, reverse=reverse, top_k=top_k)
+        return self.gmb_select(vertices, candidates, reduction_factor=reduction_factor, reverse=reverse, gmv=gmv)
+
+    def gmb_candidates(self, vertices, reverse=True, top_k=None):
+        """
+        Candidate pairs of the two-hopes neighborhood of vertices, as a
+        CANDIDATE_DTYPE array with u < v. If top_k is given, only the top_k
+        best candidates of each vertex are kept, which bounds memory on
+        vertices with huge neighborhoods. Candidates of disjoint blocks of a
+        layer can be computed independently and concatenated.
+        """
+
+        return TwoHopIndex(self['similarity'], vertices, top_k=top_k, reverse=reverse).pairs()
+
+    def gmb_select(self, vertices, candidates, reduction_factor=0.5, reverse=True, gmv=None):
+        """ Greedy selection of gmb over the candidate pairs of the whole layer. """
+
+        matching = numpy.full(self.vcount(), -1, dtype=numpy.int64)
         matching[vertices] = vertices
 
-        # Search two-hopes neighborhood for each vertex in selected layer
-        dict_edges = dict()
-        visited = [0] * self.vcount()
-        for vertex in vertices:
-            neighborhood = self.neighborhood(vertices=vertex, order=2)
-            twohops = neighborhood[(len(self['adjlist'][vertex]) + 1):]
-            for twohop in twohops:
-                if visited[twohop] == 1:
-                    continue
-                dict_edges[(vertex, twohop)] = self['similarity'](vertex, twohop)
-            visited[vertex] = 1
+        # Sorted by (u, v), without the pairs found by two blocks
+        candidates = unique_pairs(candidates)
 
         # Select promising matches or pair of vertices
-        visited = [0] * self.vcount()
-        edges = sorted(dict_edges.items(), key=operator.itemgetter(1), reverse=reverse)
-        merge_count = int(reduction_factor * len(vertices))
-        if gmv is not None:
-            while True:
-                if len(vertices) - merge_count >= gmv or reduction_factor <= 0.0:
-                    break
-                reduction_factor -= 0.01
-                merge_count = int(reduction_factor * len(vertices))
-        for edge, value in edges:
-            if merge_count == 0:
-                break
-            vertex = edge[0]
-            neighbor = edge[1]
-            if (visited[vertex] != 1) and (visited[neighbor] != 1):
-                matching[neighbor] = vertex
-                matching[vertex] = vertex
-                visited[neighbor] = 1
-                visited[vertex] = 1
-                merge_count -= 1
+        order = numpy.argsort(-candidates['score'] if reverse else candidates['score'], kind='stable')
+        merge_count = get_merge_count(len(vertices), reduction_factor, gmv)
+        rows, cols = greedy_matching(candidates['u'], candidates['v'], order, self.vcount(), merge_count)
+        matching[cols] = rows
 
         return matching
 
-    def rgmb(self, vertices=None, reduction_factor=0.5, seed_priority='random', reverse=True, gmv=None):
+    def ldm(self, vertices=None, reduction_factor=0.5, reverse=True, gmv=None, top_k=None):
+        """
+        Locally-dominant matching: matches are restricted to the two-hopes
+        neighborhood, as in gmb, but are found by rounds of handshakes
+        between vertices pointing to their most similar free candidate
+        instead of a sequential greedy pass.
+        """
+
+        candidates = self.gmb_candidates(vertices, reverse=reverse, top_k=top_k)
+        return self.ldm_select(vertices, candidates, reduction_factor=reduction_factor, reverse=reverse, gmv=gmv)
+
+    def ldm_select(self, vertices, candidates, reduction_factor=0.5, reverse=True, gmv=None):
+        """ Handshake rounds of ldm over the candidate pairs of the whole layer. """
+
+        matching = numpy.full(self.vcount(), -1, dtype=numpy.int64)
+        matching[vertices] = vertices
+
+        candidates = unique_pairs(candidates)
+        merge_count = get_merge_count(len(vertices), reduction_factor, gmv)
+        scores = candidates['score'] if reverse else -candidates['score']
+        matched = dominant_matching(candidates['u'], candidates['v'], scores, self.vcount(), merge_count)
+        matching[candidates['v'][matched]] = candidates['u'][matched]
+
+        return matching
+
+    def seed_order(self, vertices, seed_priority='random', reverse=True):
+        """ Order in which vertices are visited as seeds. """
+
+        if seed_priority == 'random':
+            return numpy.random.permutation(vertices).tolist()
+        if seed_priority == 'strength':
+            vertices_score = self.strength(vertices, weights='weight')
+        else:
+            vertices_score = self.degree(vertices)
+        order = numpy.argsort(-vertices_score if reverse else vertices_score, kind='stable')
+        return numpy.asarray(vertices)[order].tolist()
+
+    def rgmb(self, vertices=None, reduction_factor=0.5, seed_priority='random', reverse=True, gmv=None, top_k=None):
         """
         Matches are restricted between vertices that are not adjacent
         but are only allowed to match with neighbors of its neighbors,
         i.e. two-hopes neighborhood. This version use a random seed.
         """
 
-        matching = numpy.array([-1] * self.vcount())
+        matching = numpy.full(self.vcount(), -1, dtype=numpy.int64)
         matching[vertices] = vertices
 
         # Select seed set expansion
-        if seed_priority == 'strength':
-            vertices_score = numpy.array(self.strength(vertices, weights='weight'))
-            dictionary = dict(zip(vertices, vertices_score))
-            vertices_id = sorted(dictionary, key=dictionary.__getitem__, reverse=reverse)
-        if seed_priority == 'degree':
-            vertices_score = numpy.array(self.degree(vertices))
-            dictionary = dict(zip(vertices, vertices_score))
-            vertices_id = sorted(dictionary, key=dictionary.__getitem__, reverse=reverse)
-        if seed_priority == 'random':
-            vertices_id = vertices
-            vertices_id = random.sample(vertices_id, len(vertices_id))
+        vertices_id = self.seed_order(vertices, seed_priority=seed_priority, reverse=reverse)
 
         # Find the matching
-        visited = [0] * self.vcount()
-        index = 0
-        merge_count = int(reduction_factor * len(vertices))
-        if gmv is not None:
-            while True:
-                if len(vertices) - merge_count >= gmv or reduction_factor <= 0.0:
-                    break
-                reduction_factor -= 0.01
-                merge_count = int(reduction_factor * len(vertices))
-
-        while merge_count > 0 and index < len(vertices):
-            # Randomly select a vertex v of V
-            vertex = vertices_id[index]
-            if visited[vertex] == 1:
-                index += 1
+        visited = numpy.zeros(self.vcount(), dtype=bool)
+        merge_count = get_merge_count(len(vertices), reduction_factor, gmv)
+        self.rgmb_greedy(vertices_id, visited, matching, merge_count, top_k=top_k)
+
+        return matching
+
+    def rgmb_greedy(self, seeds, visited, matching, merge_count, similarity=None, top_k=None):
+        """
+        Greedy pass of rgmb: each unvisited seed, in order, is matched with its
+        most similar unvisited two-hopes neighbor. Updates visited and matching
+        in place and returns the list of matched pairs (seed, neighbor).
+        """
+
+        if similarity is None:
+            similarity = self['similarity']
+
+        # Score the two-hopes neighborhood of all seeds at once
+        index = TwoHopIndex(similarity, seeds, top_k=top_k)
+
+        pairs = []
+        for row, vertex in enumerate(seeds):
+            if merge_count == 0:
+                break
+            if visited[vertex]:
                 continue
             # Select the edge (v, u) of E which maximum score
             # Tow hopes restriction: It ensures that the match only occurs
             # between vertices of the same type
-            neighborhood = self.neighborhood(vertices=vertex, order=2)
-            twohops = neighborhood[(len(self['adjlist'][vertex]) + 1):]
-            # twohops = set((twohop for onehop in self['adjlist'][vertex] for twohop in self['adjlist'][onehop])) -
-            # set([vertex])
-            _max = 0.0
+            twohops, values = index.neighbors(row)
+            values = numpy.where(visited[twohops], 0.0, values)
             neighbor = vertex
-            for twohop in twohops:
-                if visited[twohop] == 1:
-                    continue
-                # Calling a function of a module from a string
-                score = self['similarity'](vertex, twohop)
-                if score > _max:
-                    _max = score
-                    neighbor = twohop
+            if len(values) > 0 and values.max() > 0.0:
+                neighbor = int(twohops[numpy.argmax(values)])
+            matching[neighbor] = vertex
+            matching[vertex] = vertex
+            visited[neighbor] = True
+            visited[vertex] = True
+            pairs.append((vertex, neighbor))
+            merge_count -= 1
+
+        return pairs
+
+    def rgmb_resolve(self, vertices, vertices_id, pairs, reduction_factor=0.5, gmv=None, similarity=None, top_k=None):
+        """
+        Merge the pairs proposed by rgmb over disjoint blocks of seeds. Pairs
+        are accepted in the seed order vertices_id; a seed whose neighbor was
+        already taken by a seed of higher priority is matched again, after
+        all proposals, against the remaining vertices. So is a seed that its
+        block took as the neighbor of a rejected pair, and that therefore
+        never proposed a pair of its own.
+        """
+
+        matching = numpy.full(self.vcount(), -1, dtype=numpy.int64)
+        matching[vertices] = vertices
+
+        rank = numpy.full(self.vcount(), -1, dtype=numpy.int64)
+        rank[vertices_id] = numpy.arange(len(vertices_id))
+        pairs = sorted(pairs, key=lambda pair: rank[pair[0]])
+
+        visited = numpy.zeros(self.vcount(), dtype=bool)
+        merge_count = get_merge_count(len(vertices), reduction_factor, gmv)
+        for vertex, neighbor in pairs:
+            if merge_count == 0:
+                break
+            if visited[vertex] or visited[neighbor]:
+                continue
             matching[neighbor] = vertex
             matching[vertex] = vertex
-            visited[neighbor] = 1
-            visited[vertex] = 1
+            visited[neighbor] = True
+            visited[vertex] = True
             merge_count -= 1
-            index += 1
+
+        # Seeds left free, in seed order: rejected seeds and released neighbors
+        vertices_id = numpy.asarray(vertices_id, dtype=numpy.int64)
+        conflicts = vertices_id[~visited[vertices_id]].tolist()
+        if conflicts and merge_count > 0:
+            self.rgmb_greedy(conflicts, visited, matching, merge_count, similarity=similarity, top_k=top_k)
 
         return matching
 
@@ -302,14 +910,8 @@ class MGraph(Graph):
         randomized algorithm
         """
 
-        matching = numpy.array([-1] * self['source_vertices'])
-        merge_count = int(reduction_factor * self.vcount())
-        if gmv is not None:
-            while True:
-                if self.vcount() - merge_count >= gmv or reduction_factor <= 0.0:
-                    break
-                reduction_factor -= 0.01
-                merge_count = int(reduction_factor * self.vcount())
+        matching = numpy.full(self['source_vertices'], -1, dtype=numpy.int64)
+        merge_count = get_merge_count(self.vcount(), reduction_factor, gmv)
         self.get_random_edges(merge_count, matching)
         return matching
 
@@ -319,90 +921,93 @@ class MGraph(Graph):
         weights of the edges of the graph.
         """
 
-        matching = numpy.array([-1] * self['source_vertices'])
-        merge_count = int(reduction_factor * self.vcount())
-        if gmv is not None:
-            while True:
-                if self.vcount() - merge_count >= gmv or reduction_factor <= 0.0:
-                    break
-                reduction_factor -= 0.01
-                merge_count = int(reduction_factor * self.vcount())
+        matching = numpy.full(self['source_vertices'], -1, dtype=numpy.int64)
+        merge_count = get_merge_count(self.vcount(), reduction_factor, gmv)
         self.get_sorted_edges(merge_count, matching, reverse=False)
         return matching
 
-    def mnmf(self, reduction_factor=0.5, k=100, gmv=None):
+    def mnmf(self, reduction_factor=0.5, k=100, gmv=None, itr=200, batch_size=None, init=None):
         """
-        Matching via non-negative matrix factorization
+        Matching via non-negative matrix factorization: edges are weighted by
+        the cosine of the rows of W and matched by hem. With batch_size the
+        factors are fitted by mini-batches of rows (MiniBatchNMF), and itr
+        bounds the iterations (passes over the data); init=(W, H) warm-starts
+        the factorization, e.g., with the factors of the previous level (see
+        project_factors). The factors are kept in self['factors'].
         """
 
-        N = self.vcount()
-        edges = self.get_edgelist()
-        weights = self.es['weight']
-        X = sparse.csr_matrix((weights, zip(*edges)), shape=(N, N))
-
-        model = NMF(n_components=k, init='random', random_state=0, max_iter=200, tol=0.005, solver='mu')
-        W = model.fit_transform(X)
-        H = model.components_
-
-        weights = []
-        for edge in self.es():
-            a = W[edge.tuple[0]]
-            b = W[edge.tuple[1]]
-            if not numpy.count_nonzero(a) or not numpy.count_nonzero(b):
-                weights.append(0.0)
-                continue
-            cosine = 1 - spatial.distance.cosine(a, b)
-            weights.append(cosine)
-
-        self.es['weight'] = weights
+        from sklearn.decomposition import NMF
+        try:
+            from sklearn.decomposition import MiniBatchNMF
+        except ImportError:
+            # Only available from scikit-learn 1.1
+            MiniBatchNMF = None
+
+        # Each edge once, in one direction (self-loops included), as in the
+        # edge list the factorization has always been fitted on
+        rows = numpy.repeat(numpy.arange(self.vcount(), dtype=numpy.int64), numpy.diff(self.indptr))
+        upper = rows <= self.indices
+        X = sparse.csr_matrix(
+            (self.data[upper], (rows[upper], self.indices[upper])), shape=(self.vcount(), self.vcount())
+        )
+
+        options = dict(n_components=k, random_state=0, max_iter=itr, tol=0.005)
+        fit = {}
+        if init is None:
+            options['init'] = 'random'
+        else:
+            options['init'] = 'custom'
+            fit = dict(W=numpy.array(init[0], dtype=numpy.float64), H=numpy.array(init[1], dtype=numpy.float64))
+        if batch_size is not None and MiniBatchNMF is None:
+            warnings.warn('MiniBatchNMF requires scikit-learn >= 1.1, fitting the whole matrix instead.')
+            batch_size = None
+        if batch_size is None:
+            model = NMF(solver='mu', **options)
+        else:
+            model = MiniBatchNMF(batch_size=batch_size, **options)
+        W = model.fit_transform(X, **fit)
+        self['factors'] = (W, model.components_)
+
+        # Cosine of the rows of W, zero if either row is null
+        norms = norm(W, axis=1)
+        unit = numpy.divide(W, norms[:, None], out=numpy.zeros_like(W), where=norms[:, None] > 0)
+        rows = numpy.repeat(numpy.arange(self.vcount()), numpy.diff(self.indptr))
+        weights = numpy.empty(len(rows), dtype=numpy.float64)
+        for start in range(0, len(rows), EDGE_CHUNK_SIZE):
+            end = start + EDGE_CHUNK_SIZE
+            weights[start:end] = numpy.einsum('ij,ij->i', unit[rows[start:end]], unit[self.indices[start:end]])
+
+        self.data = weights
         return self.hem(reduction_factor=reduction_factor, gmv=gmv)
 
     def msvm(self, reduction_factor=0.5, gmv=None):
         """
         Most Similar Vertex Matching: The algorithm matches the most similar pair based
-        on a similar similarity measure, like CN
+        on a similar similarity measure, like CN. Vertices are visited in random order
+        and each one is matched with its most similar unvisited neighbor, or with
+        itself if no neighbor has a positive similarity; both use up a merge. Every
+        edge is scored at once and the visits are resolved in rounds (see
+        visit_matching).
         """
 
-        matching = numpy.array([-1] * self['source_vertices'])
-        vertices = range(self.vcount())
-        vertices_id = random.sample(vertices, len(vertices))
-
-        # Find the matching
-        visited = [0] * self.vcount()
-        index = 0
-        merge_count = int(reduction_factor * len(vertices))
-        if gmv is not None:
-            while True:
-                if len(vertices) - merge_count >= gmv or reduction_factor <= 0.0:
-                    break
-                reduction_factor -= 0.01
-                merge_count = int(reduction_factor * len(vertices))
-
-        while merge_count > 0 and index < len(vertices):
-            # Randomly select a vertex v of V
-            vertex = vertices_id[index]
-            if visited[vertex] == 1:
-                index += 1
-                continue
-            # Select the edge (v, u) of E which maximum score
-            neighbors = self.neighbors(vertex)
-            _max = 0.0
-            neighbor = vertex
-            for n in neighbors:
-                if visited[n] == 1:
-                    continue
-                # Calling a function of a module from a string
-                score = self['similarity'](vertex, n)
-                if score > _max:
-                    _max = score
-                    neighbor = n
-            # Match vertex and its neighbor with maximum score
-            matching[self.vs[neighbor]['name']] = self.vs[vertex]['name']
-            matching[self.vs[vertex]['name']] = self.vs[vertex]['name']
-            visited[neighbor] = 1
-            visited[vertex] = 1
-            merge_count -= 1
-            index += 1
+        matching = numpy.full(self['source_vertices'], -1, dtype=numpy.int64)
+        merge_count = get_merge_count(self.vcount(), reduction_factor, gmv)
+
+        rows, cols, _ = self.edges()
+        scores = numpy.empty(len(rows), dtype=numpy.float64)
+        for start in range(0, len(rows), EDGE_CHUNK_SIZE):
+            end = start + EDGE_CHUNK_SIZE
+            scores[start:end] = self['similarity'].pairwise_scores(rows[start:end], cols[start:end])
+
+        # Randomly select the order in which vertices are visited
+        rank = numpy.empty(self.vcount(), dtype=numpy.int64)
+        rank[numpy.random.permutation(self.vcount())] = numpy.arange(self.vcount())
+        vertices, neighbors = visit_matching(
+            numpy.concatenate([rows, cols]), numpy.concatenate([cols, rows]), numpy.concatenate([scores, scores]),
+            rank, merge_count
+        )
+        matching[self.name[neighbors]] = self.name[vertices]
+        matching[self.name[vertices]] = self.name[vertices]
 
         return matching
 
@@ -412,14 +1017,8 @@ class MGraph(Graph):
         weights of the edges of the graph.
         """
 
-        matching = numpy.array([-1] * self['source_vertices'])
-        merge_count = int(reduction_factor * self.vcount())
-        if gmv is not None:
-            while True:
-                if self.vcount() - merge_count >= gmv or reduction_factor <= 0.0:
-                    break
-                reduction_factor -= 0.01
-                merge_count = int(reduction_factor * self.vcount())
+        matching = numpy.full(self['source_vertices'], -1, dtype=numpy.int64)
+        merge_count = get_merge_count(self.vcount(), reduction_factor, gmv)
         self.get_sorted_edges(merge_count, matching, reverse=True)
         return matching
 
@@ -429,19 +1028,9 @@ class MGraph(Graph):
         of edges without common vertices random selected.
         """
 
-        visited = [0] * self.vcount()
-        edges = sample(list(self.es()), self.ecount())
-        for edge in edges:
-            if merge_count == 0:
-                break
-            if (visited[edge.tuple[0]] == 0) and (visited[edge.tuple[1]] == 0):
-                u = self.vs[edge.tuple[0]]['name']
-                v = self.vs[edge.tuple[1]]['name']
-                matching[u] = u
-                matching[v] = u
-                visited[edge.tuple[1]] = 1
-                visited[edge.tuple[0]] = 1
-                merge_count -= 1
+        rows, cols, _ = self.edges()
+        order = numpy.random.permutation(len(rows))
+        self.match_edges(rows, cols, order, merge_count, matching)
 
     def get_sorted_edges(self, merge_count, matching, reverse=True):
         """
@@ -450,61 +1039,68 @@ class MGraph(Graph):
         minimizes the cut.
         """
 
-        visited = [0] * self.vcount()
-        edges = sorted(self.es(), key=lambda edge: edge['weight'], reverse=reverse)
-        for edge in edges:
-            if merge_count == 0:
-                break
-            if (visited[edge.tuple[0]] == 0) and (visited[edge.tuple[1]] == 0):
-                u = self.vs[edge.tuple[0]]['name']
-                v = self.vs[edge.tuple[1]]['name']
-                matching[u] = u
-                matching[v] = u
-                visited[edge.tuple[1]] = 1
-                visited[edge.tuple[0]] = 1
-                merge_count -= 1
+        rows, cols, weights = self.edges()
+        order = numpy.argsort(-weights if reverse else weights, kind='stable')
+        self.match_edges(rows, cols, order, merge_count, matching)
+
+    def match_edges(self, rows, cols, order, merge_count, matching):
+        """ Greedy independent edge set over the edges in order, written to matching by vertex name. """
 
-    def weighted_one_mode_projection(self, vertices, similarity='common_neighbors'):
+        rows, cols = greedy_matching(rows, cols, order, self.vcount(), merge_count)
+        matching[self.name[rows]] = self.name[rows]
+        matching[self.name[cols]] = self.name[rows]
+
+    def weighted_one_mode_projection(self, vertices, similarity='common_neighbors', top_k=None, threshold=None,
+                                     memory_limit=None, directory=None):
         """
         Application of a one-mode projection to a bipartite network generates
         two unipartite networks, one for each layer, so that vertices with
         common neighbors are connected by edges in their respective projection.
+        The projection is the sparse product of the biadjacency matrix (see
+        Similarity.layer_scores), sparsified to the top_k neighbors of each
+        vertex and to weights of at least threshold, and is emitted as CSR.
+        With a memory_limit it is computed in blocks bounded by the limit that
+        are spilled to directory (see TwoHopIndex).
         """
 
-        graph = MGraph()
-        graph.add_vertices(vertices)
+        vertices = numpy.asarray(vertices)
+        graph = MGraph(len(vertices))
         graph['source_vertices'] = self.vcount()
         graph['source_edges'] = self.ecount()
-        graph.vs['name'] = self.vs[vertices]['name']
-        name_to_id = dict(zip(vertices, range(graph.vcount())))
-
-        dict_edges = dict()
-        visited = [0] * self.vcount()
-        for vertex in vertices:
-            neighborhood = self.neighborhood(vertices=vertex, order=2)
-            twohops = neighborhood[(len(self['adjlist'][vertex]) + 1):]
-            for twohop in twohops:
-                if visited[twohop] == 1:
-                    continue
-                dict_edges[(name_to_id[vertex], name_to_id[twohop])] = self['projection'](vertex, twohop)
-            visited[vertex] = 1
-
-        if len(dict_edges) > 0:
-            edges, weights = list(zip(*dict_edges.items()))
-            graph.add_edges(edges)
-            graph.es['weight'] = weights
-
-        graph['adjlist'] = list(map(set, graph.get_adjlist()))
-        graph['similarity'] = getattr(Similarity(graph, graph['adjlist']), similarity)
+        graph.name = self.name[vertices]
+        name_to_id = numpy.full(self.vcount(), -1, dtype=numpy.int64)
+        name_to_id[vertices] = numpy.arange(graph.vcount())
+
+        # Score every pair of two-hopes neighbors at once; each pair is an edge
+        # of the projection weighted by the projection similarity
+        index = TwoHopIndex(
+            self['projection'], vertices, top_k=top_k, threshold=threshold, memory_limit=memory_limit,
+            directory=directory
+        )
+        graph.indptr, graph.indices, graph.data = index.projection(name_to_id)
+        graph['similarity'] = Similarity(graph, measure=similarity)
 
         return graph
 
     def mlpb(self, vertices=None, seed_priority='strength', reduction_factor=0.5, itr=10, tolerance=0.05,
-             upper_bound=0.2, n=None, gmv=None, reverse=True):
+             upper_bound=0.2, n=None, gmv=None, reverse=True, top_k=None, chunk=None, propagation=None):
 
-        """ Matching via weight-constrained label propagation and neighborhood. """
+        """
+        Matching via weight-constrained label propagation and neighborhood.
+        By default the sweep is sequential: every vertex sees all previous
+        updates. The dominant labels of a window of vertices are computed at
+        once and committed in order; once a vertex commits a change, those of
+        the next vertices are only kept if none of the labels and super-vertex
+        weights they read has changed, otherwise the window starts again from
+        the first stale vertex. With chunk, vertices are instead visited in
+        chunks of chunk vertices whose dominant labels are all computed
+        against the labels at the start of the chunk, skipping the changes
+        that no longer fit in max_size. A propagation object (see
+        coarsening.ParallelPropagation) computes the index and the dominant
+        labels of each window or chunk in other processes.
+        """
 
-        matching = numpy.array([-1] * self.vcount())
+        matching = numpy.full(self.vcount(), -1, dtype=numpy.int64)
         matching[vertices] = vertices
 
         if gmv:
@@ -516,20 +1112,37 @@ class MGraph(Graph):
 
         max_size = int(math.ceil(((1.0 + upper_bound) * n) / min_vertices))
         number_of_vertices = len(vertices)
-        weight_of_sv = self.vs['weight']
-        label_dict = dict(zip(vertices, vertices))
-        twohops_dict = collections.defaultdict(int)
-        similarity_dict = collections.defaultdict(float)
+        vertex_weight = self.weight.astype(numpy.int64)
+        weight_of_sv = vertex_weight.copy()
+        labels = numpy.arange(self.vcount(), dtype=numpy.int64)
+
+        # Score the two-hopes neighborhood of the whole layer once
+        if propagation is None:
+            index = TwoHopIndex(self['similarity'], vertices, top_k=top_k)
+
+            def votes(rows):
+                return dominant_labels(index, rows, labels, weight_of_sv, vertex_weight, max_size)
+        else:
+            index = propagation.two_hop_index(vertices, top_k)
+            # Labels and weights are updated in place, where the other processes read them
+            state = propagation.share(index, labels=labels, weight_of_sv=weight_of_sv, vertex_weight=vertex_weight)
+            labels, weight_of_sv = state['labels'], state['weight_of_sv']
+
+            def votes(rows):
+                return propagation.votes(rows, max_size)
+        position = numpy.full(self.vcount(), -1, dtype=numpy.int64)
+        position[vertices] = numpy.arange(len(vertices))
+        indptr, indices = index.indptr, index.indices
+
+        # Vertices and labels (super-vertex weights) changed since the window was computed
+        sequential = chunk is None
+        window = MLPB_WINDOW
+        changed_vertex = numpy.zeros(self.vcount(), dtype=bool)
+        changed_label = numpy.zeros(self.vcount(), dtype=bool)
 
         # Select seed set expansion: case of strength or degree seed
-        if seed_priority == 'strength':
-            vertices_score = numpy.array(self.strength(vertices, weights='weight'))
-            dictionary = dict(zip(vertices, vertices_score))
-            vertices_id = sorted(dictionary, key=dictionary.__getitem__, reverse=reverse)
-        if seed_priority == 'degree':
-            vertices_score = numpy.array(self.degree(vertices))
-            dictionary = dict(zip(vertices, vertices_score))
-            vertices_id = sorted(dictionary, key=dictionary.__getitem__, reverse=reverse)
+        if seed_priority in ['strength', 'degree']:
+            vertices_id = self.seed_order(vertices, seed_priority=seed_priority, reverse=reverse)
 
         tolerance = tolerance * len(vertices)
         swap = tolerance + 1
@@ -540,64 +1153,68 @@ class MGraph(Graph):
 
             # Select seed set expansion: case of random seed
             if seed_priority == 'random':
-                vertices_id = vertices
-                vertices_id = random.sample(vertices_id, len(vertices_id))
-
-            for vertex in vertices_id:
-
-                if self.degree(vertex) == 0:
-                    continue
-
-                # Tow hopes restriction: It ensures that the match only occurs
-                # between vertices of the same type
-                if not twohops_dict.get(vertex, False):
-                    neighborhood = self.neighborhood(vertices=vertex, order=2)
-                    twohops_dict[vertex] = neighborhood[(len(self['adjlist'][vertex]) + 1):]
-
-                # Update neighborhood edge density
-                Q = collections.defaultdict(float)
-                for neighbor in twohops_dict[vertex]:
-                    if weight_of_sv[label_dict[neighbor]] + self.vs[vertex]['weight'] <= max_size:
-                        if vertex < neighbor:
-                            u, v = vertex, neighbor
-                        else:
-                            u, v = neighbor, vertex
-                        if not similarity_dict.get((u, v), False):
-                            # similarity_dict[(u, v)] = self['similarity'](u, v) / math.sqrt(self.degree(u) + self.degree(v))
-                            similarity_dict[(u, v)] = self['similarity'](u, v)
-                        if similarity_dict[(u, v)] > 0.0:
-                            Q[label_dict[neighbor]] += similarity_dict[(u, v)]
-
-                total_similarity = sum(Q.values())
-                for li in Q.keys():
-                    Q[li] -= (total_similarity - Q[li])
-
-                if Q:
-                    # Select the dominant label
-                    dominant_label = max(Q.items(), key=operator.itemgetter(1))[0]
-                    prev_label = label_dict[vertex]
+                vertices_id = self.seed_order(vertices, seed_priority='random')
+
+            rows_id = position[vertices_id]
+            start = 0
+            stop = False
+            while start < len(rows_id) and not stop:
+                rows = rows_id[start:start + (window if sequential else chunk)]
+                voted, dominant = votes(rows)
+                dominant_labels_of = numpy.full(len(rows), -1, dtype=numpy.int64)
+                dominant_labels_of[voted] = dominant
+                changes = []
+                end = len(rows)
+                for offset, (row, dominant_label) in enumerate(zip(rows.tolist(), dominant_labels_of.tolist())):
+                    if sequential and changes:
+                        twohops = indices[indptr[row]:indptr[row + 1]]
+                        if changed_vertex[twohops].any() or changed_label[labels[twohops]].any():
+                            end = offset
+                            break
+                    if dominant_label < 0:
+                        continue
+                    vertex = int(index.vertices[row])
+                    prev_label = labels[vertex]
                     # If a dominant label was fund, match them together
                     # and update data structures
                     if dominant_label != prev_label:
+                        if weight_of_sv[dominant_label] + vertex_weight[vertex] > max_size:
+                            continue
                         swap += 1
                         # Update vertex label
-                        label_dict[vertex] = dominant_label
+                        labels[vertex] = dominant_label
                         # Update the super-vertex weight
-                        weight_of_sv[prev_label] -= self.vs[vertex]['weight']
-                        weight_of_sv[dominant_label] += self.vs[vertex]['weight']
+                        weight_of_sv[prev_label] -= vertex_weight[vertex]
+                        weight_of_sv[dominant_label] += vertex_weight[vertex]
+                        changes.append((vertex, prev_label, dominant_label))
+                        if sequential:
+                            changed_vertex[vertex] = True
+                            changed_label[prev_label] = True
+                            changed_label[dominant_label] = True
                         # Verify the size-constraint restriction
                         if weight_of_sv[prev_label] == 0:
                             number_of_vertices -= 1
                         if number_of_vertices <= min_vertices:
                             tolerance = swap
+                            stop = True
                             break
+                start += end
 
-        for key, value in label_dict.items():
-            matching[key] = value
+                if sequential:
+                    for vertex, prev_label, dominant_label in changes:
+                        changed_vertex[vertex] = False
+                        changed_label[prev_label] = False
+                        changed_label[dominant_label] = False
+                    # A window cut short is computed again from its first stale vertex; its
+                    # size follows the number of vertices committed between stale ones
+                    window = max(1, 2 * end) if end < len(rows) else min(2 * window, MLPB_MAX_WINDOW)
+
+        matching[vertices] = labels[vertices]
 
         return matching
 
     def number_of_components(self):
-        components = self.components()
-        components_sizes = components.sizes()
-        return len(components_sizes)
+        from scipy.sparse import csgraph
+
+        number, _ = csgraph.connected_components(self.csr(), directed=False)
+        return number
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared graph
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program comes with ABSOLUTELY NO WARRANTY. THE ENTIRE RISK AS TO THE QUALITY AND PERFORMANCE OF THE PROGRAM IS
+WITH YOU.
+
+Owner or contributors are not liable for any direct, indirect, incidental, special, exemplary, or consequential
+damages, (such as loss of data or profits, and others) arising in any way out of the use of this software,
+even if advised of the possibility of such damage.
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+
+Giving credit to the author by citing the papers.
+"""
+
+__maintainer__ = 'Alan Valejo'
+__email__ = 'alanvalejo@gmail.com'
+__author__ = 'Alan Valejo'
+__credits__ = ['Alan Valejo']
+__homepage__ = 'https://www.alanvalejo.com.br'
+__license__ = 'GNU.GPL.v3'
+__docformat__ = 'markdown en'
+__version__ = '0.1'
+__date__ = '2020-05-05'
+
+import numpy
+
+from multiprocessing import resource_tracker, shared_memory
+
+from models.mgraph import MGraph
+
+# Arrays of a MGraph read by the matching tasks
+SHARED_ARRAYS = ['indptr', 'indices', 'data', 'type', 'weight', 'name']
+
+# Graph attributes sent along with the shared arrays
+SHARED_ATTRIBUTES = ['layers', 'vertices', 'level']
+
+# Objects attached by the current (worker) process: handle token -> (object, blocks, group)
+attached = {}
+
+
+class SharedArrays(object):
+    """
+    Named arrays published once in shared memory blocks.
+
+    The handle is a small picklable dict (block names, dtypes and shapes)
+    sent to the workers, which map the blocks with attach_arrays(). The owner
+    reads and writes the blocks through arrays and must call unlink() once
+    the tasks using them are done. Handles of the same group can be attached
+    at the same time; attaching a handle of another group releases them.
+    """
+
+    def __init__(self, arrays, group=None):
+        self.blocks = []
+        self.arrays = {}
+        self.handle = {'arrays': {}}
+        for name, array in arrays.items():
+            array = numpy.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.arrays[name] = numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            self.arrays[name][:] = array
+            self.blocks.append(block)
+            self.handle['arrays'][name] = (block.name, array.dtype.str, array.shape)
+        self.handle['token'] = self.blocks[0].name
+        self.handle['group'] = self.handle['token'] if group is None else group
+
+    def unlink(self):
+        """ Release the blocks; attached workers keep their mapping until they detach. """
+
+        self.arrays = {}
+        for block in self.blocks:
+            block.unlink()
+            release(block)
+        self.blocks = []
+
+
+class SharedGraph(SharedArrays):
+    """
+    Arrays of a MGraph published once in shared memory blocks, along with
+    its light attributes. A worker maps them with attach() and keeps the
+    resulting graph until a handle of another level arrives.
+    """
+
+    def __init__(self, graph):
+        super().__init__({name: getattr(graph, name) for name in SHARED_ARRAYS})
+        self.handle['attributes'] = {key: graph[key] for key in SHARED_ATTRIBUTES if key in graph}
+
+
+def start_tracker():
+    """
+    Start the resource tracker of the current process. Workers created
+    afterwards share it, so blocks they attach are only tracked once and
+    released by the owner's unlink().
+    """
+
+    resource_tracker.ensure_running()
+
+
+def release(block):
+    try:
+        block.close()
+    except BufferError:
+        # Some view of the block is still alive; the mapping goes with it
+        pass
+
+
+def detach(group=None):
+    """ Drop the objects attached by the current process, except those of group. """
+
+    for token, (shared, blocks, shared_group) in list(attached.items()):
+        if group is not None and shared_group == group:
+            continue
+        # Views must go before the buffers they point to are closed
+        if isinstance(shared, MGraph):
+            shared.attributes.clear()
+            for name in SHARED_ARRAYS:
+                setattr(shared, name, None)
+        else:
+            shared.clear()
+        for block in blocks:
+            release(block)
+        del attached[token]
+
+
+def map_blocks(handle):
+    """ Read-only views of the blocks of handle, and the blocks. """
+
+    arrays = {}
+    blocks = []
+    for name, (block_name, dtype, shape) in handle['arrays'].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=block.buf)
+        arrays[name].flags.writeable = False
+        blocks.append(block)
+    return arrays, blocks
+
+
+def attach_arrays(handle):
+    """ Arrays of a SharedArrays handle, read-only. """
+
+    token = handle['token']
+    if token not in attached:
+        detach(handle['group'])
+        arrays, blocks = map_blocks(handle)
+        attached[token] = (arrays, blocks, handle['group'])
+    return attached[token][0]
+
+
+def attach(handle):
+    """ Graph backed by the shared blocks of a SharedGraph handle, read-only. """
+
+    token = handle['token']
+    if token in attached:
+        return attached[token][0]
+
+    # A handle of another group means the previous level is over
+    detach(handle['group'])
+    arrays, blocks = map_blocks(handle)
+    graph = MGraph()
+    for name, array in arrays.items():
+        setattr(graph, name, array)
+    graph.attributes = dict(handle['attributes'])
+    graph['similarity'] = None
+    graph['vertices_by_type'] = []
+    for layer in range(graph['layers']):
+        graph['vertices_by_type'].append(numpy.flatnonzero(graph.type == layer))
+    attached[token] = (graph, blocks, handle['group'])
+    return graph
@@ -23,7 +23,11 @@ Giving credit to the author by citing the papers.
 """
 
 import math
+import numpy
+import hashlib
+import collections
 
+from scipy import sparse
 from numpy import dot
 from numpy.linalg import norm
 from numpy import linalg as LA
@@ -38,13 +42,314 @@ __docformat__ = 'markdown en'
 __version__ = '0.1'
 __date__ = '2020-05-05'
 
+# Measures whose score is a sum over common neighbors z of a per-vertex factor f(z)
+INTERMEDIATE_MEASURES = ['adamic_adar', 'resource_allocation', 'newman_collaboration']
+
+# Measures whose score is a function of the number of common neighbors and of the degrees of the pair
+COMMON_NEIGHBORS_MEASURES = [
+	'common_neighbors', 'jaccard', 'salton', 'sorensen', 'hub_promoted', 'hub_depressed', 'leicht_holme_newman'
+]
+
+# Measures based on the edge-weight information
+WEIGHTED_MEASURES = ['weighted_common_neighbors', 'weighted_jaccard']
+
+class ScoreCache(object):
+	"""
+	Bounded LRU cache of rows of two-hop scores (see Similarity.layer_scores).
+	Rows are keyed by a digest of the graph they were scored on, so a level
+	coarsened again in the same process, e.g., the source graph of each run
+	of a batch, reuses them; size bounds the number of scores kept. hits and
+	misses count rows.
+	"""
+
+	def __init__(self, size):
+		self.size = size
+		self.rows = collections.OrderedDict()
+		self.used = 0
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		row = self.rows.get(key)
+		if row is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.rows.move_to_end(key)
+		return row
+
+	def put(self, key, row):
+		cost = max(len(row[0]), 1)
+		if cost > self.size or key in self.rows:
+			return
+		self.rows[key] = row
+		self.used += cost
+		while self.used > self.size:
+			_, (indices, _) = self.rows.popitem(last=False)
+			self.used -= max(len(indices), 1)
+
+def set_cache(size):
+	""" Share a ScoreCache of size scores among the Similarity objects of the process (none if size is None). """
+
+	if size is None:
+		Similarity.cache = None
+	elif Similarity.cache is None or Similarity.cache.size != size:
+		Similarity.cache = ScoreCache(size)
+
 class Similarity(object):
 
-	graph, adjlist = (None,) * 2
+	graph, measure = (None,) * 2
+
+	# Score cache of the process, see set_cache
+	cache = None
 
-	def __init__(self, graph, adjlist):
+	def __init__(self, graph, measure=None, max_degree=None, sample=False):
 		self.graph = graph
-		self.adjlist = adjlist
+		self.measure = measure
+		self.max_degree = max_degree
+		self.sample = sample
+		self._adjacency = None
+		self._pattern = None
+		self._hops = None
+		self._digest = None
+
+		# Per-vertex arrays read by every measure instead of querying the graph per pair
+		self.vertex_degree = numpy.diff(graph.indptr).astype(numpy.float64)
+		self.vertex_strength = numpy.asarray(graph.strength(weights='weight'), dtype=numpy.float64)
+		self.inverse_degree = numpy.zeros(len(self.vertex_degree))
+		self.inverse_log_degree = numpy.zeros(len(self.vertex_degree))
+		self.inverse_collaboration = numpy.zeros(len(self.vertex_degree))
+		mask = self.vertex_degree > 0
+		self.inverse_degree[mask] = 1.0 / self.vertex_degree[mask]
+		mask = self.vertex_degree > 1
+		self.inverse_log_degree[mask] = 1.0 / numpy.log(self.vertex_degree[mask])
+		self.inverse_collaboration[mask] = 1.0 / (self.vertex_degree[mask] - 1)
+
+	def __call__(self, i, j):
+		""" Calculates pairwise similarity using the default measure. """
+
+		return getattr(self, self.measure)(i, j)
+
+	def __getstate__(self):
+		# Sparse matrices are rebuilt on demand rather than pickled with the graph
+		state = self.__dict__.copy()
+		state['_adjacency'] = None
+		state['_pattern'] = None
+		state['_hops'] = None
+		return state
+
+	@property
+	def adjacency(self):
+		""" Weighted adjacency matrix of the graph in CSR format. """
+
+		if self._adjacency is None:
+			self._adjacency = self.graph.csr()
+		return self._adjacency
+
+	@property
+	def pattern(self):
+		""" Binary (unweighted) adjacency matrix of the graph in CSR format. """
+
+		if self._pattern is None:
+			adjacency = self.adjacency
+			data = numpy.ones(adjacency.nnz, dtype=numpy.float64)
+			self._pattern = sparse.csr_matrix((data, adjacency.indices, adjacency.indptr), shape=adjacency.shape)
+		return self._pattern
+
+	@property
+	def hops(self):
+		"""
+		Pattern and adjacency matrices (rows are intermediate vertices) through
+		which two-hopes neighbors are reached, with their transposes. Hubs,
+		vertices of degree above max_degree, are dropped as intermediates or,
+		if sample, reach only max_degree of their neighbors chosen at random.
+		"""
+
+		if self._hops is None:
+			pattern, adjacency = self.pattern, self.adjacency
+			if self.max_degree is None:
+				self._hops = (pattern, adjacency, pattern, adjacency)
+			else:
+				degree = numpy.diff(pattern.indptr)
+				rows = numpy.repeat(numpy.arange(pattern.shape[0]), degree)
+				keep = degree[rows] <= self.max_degree
+				if self.sample:
+					order = numpy.lexsort((numpy.random.random(pattern.nnz), rows))
+					rank = numpy.arange(pattern.nnz) - pattern.indptr[rows[order]]
+					keep[order[rank < self.max_degree]] = True
+				indptr = numpy.zeros(pattern.shape[0] + 1, dtype=numpy.int64)
+				numpy.cumsum(numpy.bincount(rows[keep], minlength=pattern.shape[0]), out=indptr[1:])
+				matrices = [
+					sparse.csr_matrix((matrix.data[keep], matrix.indices[keep], indptr), shape=matrix.shape)
+					for matrix in (pattern, adjacency)
+				]
+				self._hops = tuple(matrices) + tuple(matrix.T.tocsr() for matrix in matrices)
+		return self._hops
+
+	@property
+	def digest(self):
+		""" Digest of the CSR arrays of the graph, which identifies its rows in the cache. """
+
+		if self._digest is None:
+			digest = hashlib.blake2b(digest_size=16)
+			for array in (self.graph.indptr, self.graph.indices, self.graph.data):
+				digest.update(numpy.ascontiguousarray(array).view(numpy.uint8))
+			self._digest = digest.digest()
+		return self._digest
+
+	def paths(self, vertices):
+		"""
+		Number of two-hop paths from each vertex in vertices, an upper bound of
+		the length of its row in layer_scores.
+		"""
+
+		pattern, _, pattern_t, _ = self.hops
+		return pattern_t[vertices].dot(numpy.diff(pattern.indptr)).astype(numpy.int64)
+
+	def degrees(self):
+		""" Degree of every vertex as a float array. """
+
+		return self.vertex_degree
+
+	def strengths(self):
+		""" Strength (sum of incident edge weights) of every vertex. """
+
+		return self.vertex_strength
+
+	def intermediate_factor(self, measure):
+		""" Per-vertex factor f(z) each common neighbor z contributes to the score. """
+
+		if measure == 'adamic_adar':
+			return self.inverse_log_degree
+		elif measure == 'resource_allocation':
+			return self.inverse_degree
+		elif measure == 'newman_collaboration':
+			return self.inverse_collaboration
+		return numpy.ones(len(self.vertex_degree))
+
+	def normalize(self, measure, cn, i, j):
+		"""
+		Turns the (weighted) number of common neighbors cn of the pairs (i, j)
+		into the score of the given measure.
+		"""
+
+		cn = numpy.asarray(cn, dtype=numpy.float64)
+		if measure in ['common_neighbors', 'weighted_common_neighbors'] + INTERMEDIATE_MEASURES:
+			return cn
+		if measure == 'unweight':
+			return numpy.ones(len(cn))
+
+		if measure == 'weighted_jaccard':
+			strength = self.strengths()
+			union = (strength[i] + strength[j]) / 2.0 - cn
+			union[union <= 1e-12 * (strength[i] + strength[j])] = 0.0
+			return numpy.divide(cn, union, out=numpy.zeros(len(cn)), where=union > 0)
+
+		degree = self.degrees()
+		d_i, d_j = degree[i], degree[j]
+		if measure == 'preferential_attachment':
+			return d_i * d_j
+		if measure == 'jaccard':
+			denominator = d_i + d_j - cn
+		elif measure == 'salton':
+			denominator = numpy.sqrt(d_i * d_j)
+		elif measure == 'sorensen':
+			denominator = (d_i * d_j) / 2.0
+		elif measure == 'hub_promoted':
+			denominator = numpy.minimum(d_i, d_j)
+		elif measure == 'hub_depressed':
+			denominator = numpy.maximum(d_i, d_j)
+		elif measure == 'leicht_holme_newman':
+			denominator = d_i * d_j
+		else:
+			raise ValueError('Similarity ' + str(measure) + ' has no batch implementation.')
+		return numpy.divide(cn, denominator, out=numpy.zeros(len(cn)), where=denominator > 0)
+
+	def pairwise_scores(self, rows, cols, measure=None):
+		"""
+		Calculates the similarity of a whole array of pairs (rows[k], cols[k]) at once
+		using elementwise products of the CSR adjacency rows.
+		"""
+
+		measure = measure or self.measure
+		rows = numpy.asarray(rows, dtype=numpy.int64)
+		cols = numpy.asarray(cols, dtype=numpy.int64)
+		if len(rows) == 0:
+			return numpy.zeros(0)
+
+		if measure == 'weight':
+			return numpy.asarray(self.adjacency[rows, cols]).ravel()
+		if measure in ['unweight', 'preferential_attachment']:
+			cn = numpy.zeros(len(rows))
+		elif measure in WEIGHTED_MEASURES:
+			pattern, adjacency = self.pattern, self.adjacency
+			cn = numpy.asarray(adjacency[rows].multiply(pattern[cols]).sum(axis=1)).ravel()
+			cn += numpy.asarray(pattern[rows].multiply(adjacency[cols]).sum(axis=1)).ravel()
+			cn /= 2.0
+		else:
+			pattern = self.pattern
+			common = pattern[rows].multiply(pattern[cols]).tocsr()
+			cn = common.dot(self.intermediate_factor(measure))
+		return self.normalize(measure, cn, rows, cols)
+
+	def layer_scores(self, vertices, measure=None):
+		"""
+		Calculates the similarity between each vertex in vertices and all its two-hop
+		neighbors at once, i.e., the sparse product B * F * B^T of the biadjacency
+		rows of vertices, where F weights the intermediate vertices (see hops).
+		Returns a CSR matrix with one row per vertex in vertices and one column per
+		vertex of the graph. The vertex itself is not included in its row.
+		With a cache, rows already scored on the same graph are reused; rows
+		of sampled hubs are random and never cached.
+		"""
+
+		measure = measure or self.measure
+		vertices = numpy.asarray(vertices, dtype=numpy.int64)
+		if self.cache is None or self.sample:
+			return self.compute_layer_scores(vertices, measure)
+
+		prefix = (self.digest, measure, self.max_degree)
+		rows = [self.cache.get(prefix + (vertex,)) for vertex in vertices.tolist()]
+		missing = [index for index, row in enumerate(rows) if row is None]
+		if missing:
+			scores = self.compute_layer_scores(vertices[missing], measure)
+			for position, index in enumerate(missing):
+				start, end = scores.indptr[position], scores.indptr[position + 1]
+				rows[index] = (scores.indices[start:end].copy(), scores.data[start:end].copy())
+				self.cache.put(prefix + (int(vertices[index]),), rows[index])
+
+		indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+		numpy.cumsum([len(indices) for indices, _ in rows], out=indptr[1:])
+		indices = numpy.concatenate([indices for indices, _ in rows] + [numpy.zeros(0, dtype=numpy.int32)])
+		data = numpy.concatenate([data for _, data in rows] + [numpy.zeros(0)])
+		return sparse.csr_matrix((data, indices, indptr), shape=(len(vertices), self.graph.vcount()))
+
+	def compute_layer_scores(self, vertices, measure):
+		""" Uncached layer_scores. """
+
+		pattern, adjacency, pattern_t, adjacency_t = self.hops
+		block = pattern_t[vertices]
+
+		if measure in WEIGHTED_MEASURES:
+			product = (adjacency_t[vertices].dot(pattern) + block.dot(adjacency)) / 2.0
+		else:
+			factor = sparse.diags(self.intermediate_factor(measure))
+			product = block.dot(factor).dot(pattern)
+		product = sparse.csr_matrix(product)
+
+		# Remove the vertex itself from its two-hop neighborhood
+		product = product.tocoo()
+		rows = vertices[product.row]
+		mask = rows != product.col
+		rows, cols, cn = rows[mask], product.col[mask].astype(numpy.int64), product.data[mask]
+		scores = self.normalize(measure, cn, rows, cols)
+
+		result = sparse.csr_matrix(
+			(scores, (product.row[mask], cols)), shape=(len(vertices), self.graph.vcount())
+		)
+		result.eliminate_zeros()
+		result.sort_indices()
+		return result
 
 	def unweight(self, i, j):
 		""" Calculates pairwise weight edge on a given graph. """
@@ -59,7 +364,12 @@ class Similarity(object):
 	def get_common_neighbors(self, i, j):
 		""" Calculates pairwise common neighbors similarity on a given unweighted graph. """
 
-		return self.adjlist[i].intersection(self.adjlist[j])
+		neighbors_i, neighbors_j = self.graph.neighbors(i), self.graph.neighbors(j)
+		if len(neighbors_i) == 0:
+			return neighbors_i
+		# Neighbors are sorted in the CSR rows
+		position = numpy.minimum(numpy.searchsorted(neighbors_i, neighbors_j), len(neighbors_i) - 1)
+		return neighbors_j[neighbors_i[position] == neighbors_j]
 
 	def nmf_cosine(self, i, j):
 		""" The similarity between two nodes is given by the cosine of the
@@ -74,21 +384,17 @@ class Similarity(object):
 	def preferential_attachment(self, i, j):
 		""" Calculates pairwise preferential attachment similarities on a given unweighted graph. """
 
-		return float(self.graph.degree(i)) * float(self.graph.degree(j))
+		return float(self.vertex_degree[i] * self.vertex_degree[j])
 
 	def common_neighbors(self, i, j):
 		""" Calculates pairwise common neighbors similarity on a given unweighted graph. """
 
-		return len(self.adjlist[i].intersection(self.adjlist[j]))
+		return len(self.get_common_neighbors(i, j))
 
 	def newman_collaboration(self, i, j):
 		""" Calculates pairwise Newman’s collaboration similarity """
 
-		_sum = 0.0
-		cn = self.adjlist[i].intersection(self.adjlist[j])
-		for z in cn:
-			_sum += 1 / (self.graph.strength(z) - 1)
-		return _sum
+		return float(self.inverse_collaboration[self.get_common_neighbors(i, j)].sum())
 
 	def weighted_common_neighbors(self, i, j):
 		"""
@@ -96,102 +402,100 @@ class Similarity(object):
 		on a given unweighted graph.
 		"""
 
-		_sum = 0.0
-		cn = self.adjlist[i].intersection(self.adjlist[j])
-		for z in cn:
-			_sum += (self.graph[i, z] + self.graph[j, z]) / 2
-		return _sum
+		return self.get_weighted_common_neighbors(i, j)
+
+	def get_weighted_common_neighbors(self, i, j):
+		"""
+		Sum of (w(i, z) + w(j, z)) / 2 over the common neighbors z of i and j,
+		found by a binary search of the sorted neighbors of j in the CSR row of i.
+		"""
+
+		graph = self.graph
+		start_i, end_i = graph.indptr[i], graph.indptr[i + 1]
+		start_j, end_j = graph.indptr[j], graph.indptr[j + 1]
+		if start_i == end_i or start_j == end_j:
+			return 0.0
+		neighbors_i = graph.indices[start_i:end_i]
+		neighbors_j = graph.indices[start_j:end_j]
+		position = numpy.minimum(numpy.searchsorted(neighbors_i, neighbors_j), len(neighbors_i) - 1)
+		common = neighbors_i[position] == neighbors_j
+		return float(graph.data[start_i + position[common]].sum() + graph.data[start_j:end_j][common].sum()) / 2
 
 	def jaccard(self, i, j):
 		""" Calculates pairwise jaccard similarity on a given unweighted graph. """
 
-		isect = len(self.adjlist[i].intersection(self.adjlist[j]))
-		union = (len(self.adjlist[i]) + len(self.adjlist[j]) - isect)
+		isect = len(self.get_common_neighbors(i, j))
+		union = self.vertex_degree[i] + self.vertex_degree[j] - isect
 		return 0 if union == 0 else isect / float(union)
 
 	def weighted_jaccard(self, i, j):
 		""" Calculates pairwise jaccard similarity on a given unweighted graph. """
 
-		_sum_isect = 0.0
-		isect = self.adjlist[i].intersection(self.adjlist[j])
-		for z in isect:
-			_sum_isect += (self.graph[i, z] + self.graph[j, z]) / 2
-
-		_sum_union = 0.0
-		union = self.adjlist[i].union(self.adjlist[j]) - isect
-		for z in union:
-			_sum_union += (self.graph[i, z] + self.graph[j, z]) / 2
-
-		return 0 if _sum_union == 0.0 else _sum_isect / _sum_union
+		_sum_isect = self.get_weighted_common_neighbors(i, j)
+		# Neighbors of only one of them: half of the strengths not spent on common neighbors
+		_sum_union = (self.vertex_strength[i] + self.vertex_strength[j]) / 2.0 - _sum_isect
+		if _sum_union <= 1e-12 * (self.vertex_strength[i] + self.vertex_strength[j]):
+			return 0
+		return _sum_isect / _sum_union
 
 	def salton(self, i, j):
 		""" Calculates pairwise solton similarity on a given unweighted graph. """
 
-		product = float(self.graph.degree(i)) * float(self.graph.degree(j))
+		product = float(self.vertex_degree[i] * self.vertex_degree[j])
 		if product == 0.0:
 			return 0.0
 
-		isect = len(self.adjlist[i].intersection(self.adjlist[j]))
+		isect = len(self.get_common_neighbors(i, j))
 		return isect / math.sqrt(product)
 
 	def adamic_adar(self, i, j):
 		""" Calculates pairwise adamic adar similarity on a given unweighted graph. """
 
-		score = 0.0
-		for isect in self.adjlist[i].intersection(self.adjlist[j]):
-			degree = self.graph.degree(isect)
-			if degree != 0:
-				score += 1 / math.log(degree)
-		return score
+		return float(self.inverse_log_degree[self.get_common_neighbors(i, j)].sum())
 
 	def resource_allocation(self, i, j):
 		""" Calculates pairwise resource allocation similarity on a given unweighted graph. """
 
-		score = 0.0
-		for isect in self.adjlist[i].intersection(self.adjlist[j]):
-			degree = self.graph.degree(isect)
-			if degree != 0:
-				score += 1 / degree
-		return score
+		return float(self.inverse_degree[self.get_common_neighbors(i, j)].sum())
 
 	def sorensen(self, i, j):
 		""" Calculates pairwise sorensen similarity on a given unweighted graph. """
 
-		_sum = float(self.graph.degree(i)) * float(self.graph.degree(j))
+		_sum = float(self.vertex_degree[i] * self.vertex_degree[j])
 		if _sum == 0.0:
 			return 0.0
 
-		isect = 2 * len(self.adjlist[i].intersection(self.adjlist[j]))
+		isect = 2 * len(self.get_common_neighbors(i, j))
 		return isect / _sum
 
 	def hub_promoted(self, i, j):
 		""" Calculates pairwise hub promoted similarity on a given unweighted graph. """
 
-		minimum = min(float(self.graph.degree(i)), float(self.graph.degree(j)))
+		minimum = float(min(self.vertex_degree[i], self.vertex_degree[j]))
 		if minimum == 0.0:
 			return 0.0
 
-		isect = len(self.adjlist[i].intersection(self.adjlist[j]))
+		isect = len(self.get_common_neighbors(i, j))
 		return isect / minimum
 
 	def hub_depressed(self, i, j):
 		""" Calculates pairwise hub depressed similarity on a given unweighted graph. """
 
-		maximum = max(float(self.graph.degree(i)), float(self.graph.degree(j)))
+		maximum = float(max(self.vertex_degree[i], self.vertex_degree[j]))
 		if maximum == 0.0:
 			return 0.0
 
-		isect = len(self.adjlist[i].intersection(self.adjlist[j]))
+		isect = len(self.get_common_neighbors(i, j))
 		return isect / maximum
 
 	def leicht_holme_newman(self, i, j):
 		""" Calculates pairwise leicht holmeNewman similarity on a given unweighted graph. """
 
-		product = float(self.graph.degree(i)) * float(self.graph.degree(j))
+		product = float(self.vertex_degree[i] * self.vertex_degree[j])
 		if product == 0.0:
 			return 0.0
 
-		isect = len(self.adjlist[i].intersection(self.adjlist[j]))
+		isect = len(self.get_common_neighbors(i, j))
 		return isect / product
 
 	def within_common_neighbors(self, i, j):
@@ -201,7 +505,7 @@ class Similarity(object):
 		common neighbors instead of the set of all common neighbors
 		"""
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		within_isect = 0.0
 		for vertex in isect:
 			if self.vs[vertex]['membership'] == self.vs[i]['membership']:
@@ -215,12 +519,12 @@ class Similarity(object):
 		common neighbors instead of the set of all common neighbors
 		"""
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		within_isect = 0.0
 		for vertex in isect:
 			if self.vs[vertex]['membership'] == self.vs[i]['membership']:
 				within_isect += 1.0
-		union = (len(self.adjlist[i]) + len(self.adjlist[j]) - within_isect)
+		union = (self.vertex_degree[i] + self.vertex_degree[j] - within_isect)
 		return 0 if union == 0 else within_isect / float(union)
 
 	def within_salton(self, i, j):
@@ -230,12 +534,12 @@ class Similarity(object):
 		common neighbors instead of the set of all common neighbors
 		"""
 
-		product = float(self.graph.degree(i)) * float(self.graph.degree(j))
+		product = float(self.vertex_degree[i] * self.vertex_degree[j])
 
 		if product == 0.0:
 			return 0.0
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		within_isect = 0.0
 		for vertex in isect:
 			if self.vs[vertex]['membership'] == self.vs[i]['membership']:
@@ -250,11 +554,9 @@ class Similarity(object):
 		"""
 
 		score = 0.0
-		for isect in self.adjlist[i].intersection(self.adjlist[j]):
+		for isect in self.get_common_neighbors(i, j):
 			if self.vs[isect]['membership'] == self.vs[i]['membership']:
-				degree = self.graph.degree(isect)
-				if degree != 0:
-					score += 1 / math.log(degree)
+				score += self.inverse_log_degree[isect]
 		return score
 
 	def within_resource_allocation(self, i, j):
@@ -265,11 +567,9 @@ class Similarity(object):
 		"""
 
 		score = 0.0
-		for isect in self.adjlist[i].intersection(self.adjlist[j]):
+		for isect in self.get_common_neighbors(i, j):
 			if self.vs[isect]['membership'] == self.vs[i]['membership']:
-				degree = self.graph.degree(isect)
-				if degree != 0:
-					score += 1 / degree
+				score += self.inverse_degree[isect]
 		return score
 
 	def within_sorensen(self, i, j):
@@ -279,11 +579,11 @@ class Similarity(object):
 		common neighbors instead of the set of all common neighbors
 		"""
 
-		_sum = float(self.graph.degree(i)) * float(self.graph.degree(j))
+		_sum = float(self.vertex_degree[i] * self.vertex_degree[j])
 		if _sum == 0.0:
 			return 0.0
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		within_isect = 0.0
 		for vertex in isect:
 			if self.vs[vertex]['membership'] == self.vs[i]['membership']:
@@ -297,11 +597,11 @@ class Similarity(object):
 		common neighbors instead of the set of all common neighbors
 		"""
 
-		minimum = min(float(self.graph.degree(i)), float(self.graph.degree(j)))
+		minimum = float(min(self.vertex_degree[i], self.vertex_degree[j]))
 		if minimum == 0.0:
 			return 0.0
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		within_isect = 0.0
 		for vertex in isect:
 			if self.vs[vertex]['membership'] == self.vs[i]['membership']:
@@ -315,11 +615,11 @@ class Similarity(object):
 		common neighbors instead of the set of all common neighbors
 		"""
 
-		maximum = max(float(self.graph.degree(i)), float(self.graph.degree(j)))
+		maximum = float(max(self.vertex_degree[i], self.vertex_degree[j]))
 		if maximum == 0.0:
 			return 0.0
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		within_isect = 0.0
 		for vertex in isect:
 			if self.vs[vertex]['membership'] == self.vs[i]['membership']:
@@ -333,11 +633,11 @@ class Similarity(object):
 		common neighbors instead of the set of all common neighbors
 		"""
 
-		product = float(self.graph.degree(i)) * float(self.graph.degree(j))
+		product = float(self.vertex_degree[i] * self.vertex_degree[j])
 		if product == 0.0:
 			return 0.0
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		within_isect = 0.0
 		for vertex in isect:
 			if self.vs[vertex]['membership'] == self.vs[i]['membership']:
@@ -351,7 +651,7 @@ class Similarity(object):
 		neighbors of these vertices.
 		"""
 
-		isect = self.adjlist[i].intersection(self.adjlist[j])
+		isect = self.get_common_neighbors(i, j)
 		nWcn = 0.0 # Intra cluster or intra community
 		nIcn = 0.0 # Inter clusters or inter comunities
 		for vertex in isect:
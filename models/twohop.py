@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Two-hopes index
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program comes with ABSOLUTELY NO WARRANTY. THE ENTIRE RISK AS TO THE QUALITY AND PERFORMANCE OF THE PROGRAM IS
+WITH YOU.
+
+Owner or contributors are not liable for any direct, indirect, incidental, special, exemplary, or consequential
+damages, (such as loss of data or profits, and others) arising in any way out of the use of this software,
+even if advised of the possibility of such damage.
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+
+Giving credit to the author by citing the papers.
+"""
+
+__maintainer__ = 'Alan Valejo'
+__email__ = 'alanvalejo@gmail.com'
+__author__ = 'Alan Valejo'
+__credits__ = ['Alan Valejo']
+__homepage__ = 'https://www.alanvalejo.com.br'
+__license__ = 'GNU.GPL.v3'
+__docformat__ = 'markdown en'
+__version__ = '0.1'
+__date__ = '2020-05-05'
+
+import numpy
+import tempfile
+
+from scipy import sparse
+
+# Number of vertices whose two-hopes neighborhood is scored at once
+CANDIDATE_CHUNK_SIZE = 4096
+
+# Estimated peak bytes per scored pair while a block of the index is computed
+ENTRY_BYTES = 64
+
+# Record of a candidate pair of vertices and its similarity
+CANDIDATE_DTYPE = numpy.dtype([('u', numpy.int64), ('v', numpy.int64), ('score', numpy.float64)])
+
+
+def top_k_rows(matrix, k, reverse=True):
+    """
+    Keep the k best entries of each row of a CSR matrix (largest if reverse,
+    smallest otherwise); ties keep the column order.
+    """
+
+    lengths = numpy.diff(matrix.indptr)
+    rows = numpy.repeat(numpy.arange(matrix.shape[0]), lengths)
+    # Only rows longer than k have to be sorted
+    keep = lengths[rows] <= k
+    long = numpy.flatnonzero(~keep)
+    order = long[numpy.lexsort((-matrix.data[long] if reverse else matrix.data[long], rows[long]))]
+    ptr = numpy.zeros(matrix.shape[0] + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.where(lengths > k, lengths, 0), out=ptr[1:])
+    rank = numpy.arange(len(order)) - ptr[rows[order]]
+    keep[order[rank < k]] = True
+    indptr = numpy.zeros(matrix.shape[0] + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(rows[keep], minlength=matrix.shape[0]), out=indptr[1:])
+    return sparse.csr_matrix((matrix.data[keep], matrix.indices[keep], indptr), shape=matrix.shape)
+
+
+def threshold_rows(matrix, threshold, reverse=True):
+    """
+    Keep the entries of a CSR matrix scoring at least threshold (at most if
+    not reverse).
+    """
+
+    keep = matrix.data >= threshold if reverse else matrix.data <= threshold
+    rows = numpy.repeat(numpy.arange(matrix.shape[0]), numpy.diff(matrix.indptr))
+    indptr = numpy.zeros(matrix.shape[0] + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(rows[keep], minlength=matrix.shape[0]), out=indptr[1:])
+    return sparse.csr_matrix((matrix.data[keep], matrix.indices[keep], indptr), shape=matrix.shape)
+
+
+def unique_pairs(candidates):
+    """ Candidates sorted by (u, v), keeping the first record of each pair. """
+
+    candidates = candidates[numpy.lexsort((candidates['v'], candidates['u']))]
+    first = numpy.ones(len(candidates), dtype=bool)
+    first[1:] = (candidates['u'][1:] != candidates['u'][:-1]) | (candidates['v'][1:] != candidates['v'][:-1])
+    return candidates[first]
+
+
+def memory_blocks(costs, memory_limit):
+    """
+    Split a sequence of costs into consecutive blocks (start, end) whose total
+    cost is at most memory_limit; a single item above it is a block by itself.
+    """
+
+    blocks = []
+    start = 0
+    total = numpy.cumsum(costs)
+    while start < len(costs):
+        base = total[start - 1] if start > 0 else 0
+        end = int(numpy.searchsorted(total, base + memory_limit, side='right'))
+        end = max(end, start + 1)
+        blocks.append((start, end))
+        start = end
+    return blocks
+
+
+class SpilledRows(object):
+    """ CSR rows appended block by block to temporary files. """
+
+    def __init__(self, directory=None):
+        self.lengths = []
+        self.files = {
+            'indices': tempfile.TemporaryFile(dir=directory), 'data': tempfile.TemporaryFile(dir=directory)
+        }
+        self.dtypes = {'indices': numpy.dtype(numpy.int32), 'data': numpy.dtype(numpy.float64)}
+
+    def append(self, matrix):
+        self.lengths.append(numpy.diff(matrix.indptr))
+        for name, f in self.files.items():
+            f.write(numpy.ascontiguousarray(getattr(matrix, name), dtype=self.dtypes[name]).tobytes())
+
+    def arrays(self):
+        """ CSR arrays (indptr, indices, data) of the rows, memory-mapped. """
+
+        indptr = numpy.zeros(sum(len(lengths) for lengths in self.lengths) + 1, dtype=numpy.int64)
+        if self.lengths:
+            numpy.cumsum(numpy.concatenate(self.lengths), out=indptr[1:])
+        arrays = [indptr]
+        for name, f in self.files.items():
+            f.flush()
+            if indptr[-1] == 0:
+                arrays.append(numpy.zeros(0, dtype=self.dtypes[name]))
+            else:
+                arrays.append(numpy.memmap(f, dtype=self.dtypes[name], mode='r', shape=(int(indptr[-1]),)))
+            f.close()
+        return tuple(arrays)
+
+
+class TwoHopIndex(object):
+    """
+    Two-hopes neighbors of a set of vertices with their similarity, as the
+    CSR arrays (indptr, indices, data) of a matrix with one row per vertex
+    (in the given order) and one column per vertex of the graph.
+
+    Vertices are scored in chunks of CANDIDATE_CHUNK_SIZE and, if top_k is
+    given, only the top_k best neighbors of each vertex are kept, so the
+    matchers scan bounded candidate lists; neighbors scoring worse than
+    threshold are dropped as well. Hubs among the intermediate
+    vertices are pruned by the Similarity itself (see max_degree). An index
+    computed elsewhere, e.g. by blocks in other processes, is rebuilt from
+    its arrays without similarity.
+
+    With a memory_limit (in bytes) the blocks are instead sized so that the
+    two-hop paths of a block fit in it, and the sparsified blocks are spilled
+    to temporary files in directory; indices and data are then memory-mapped
+    and only indptr is kept in memory.
+    """
+
+    def __init__(self, similarity, vertices, top_k=None, reverse=True, arrays=None, threshold=None,
+                 memory_limit=None, directory=None):
+        self.vertices = numpy.asarray(vertices, dtype=numpy.int64)
+        if arrays is not None:
+            self.indptr, self.indices, self.data = arrays
+            return
+
+        if memory_limit is None:
+            blocks = range(0, len(self.vertices), CANDIDATE_CHUNK_SIZE)
+            blocks = [(start, min(start + CANDIDATE_CHUNK_SIZE, len(self.vertices))) for start in blocks]
+            chunks = []
+        else:
+            blocks = memory_blocks(similarity.paths(self.vertices) * ENTRY_BYTES, memory_limit)
+            chunks = SpilledRows(directory)
+
+        for start, end in blocks:
+            scores = similarity.layer_scores(self.vertices[start:end])
+            if threshold is not None:
+                scores = threshold_rows(scores, threshold, reverse=reverse)
+            if top_k is not None:
+                scores = top_k_rows(scores, top_k, reverse=reverse)
+            chunks.append(scores)
+
+        if memory_limit is not None:
+            self.indptr, self.indices, self.data = chunks.arrays()
+        else:
+            if chunks:
+                scores = sparse.vstack(chunks, format='csr')
+            else:
+                scores = sparse.csr_matrix((0, similarity.graph.vcount()))
+            self.indptr, self.indices, self.data = scores.indptr, scores.indices, scores.data
+
+    def arrays(self):
+        return self.indptr, self.indices, self.data
+
+    def neighbors(self, row):
+        """ Two-hopes neighbors of the vertex in the given row and their similarities. """
+
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def pairs(self):
+        """ Pairs of the index as a CANDIDATE_DTYPE array, each pair once with u < v. """
+
+        rows = self.vertices[numpy.repeat(numpy.arange(len(self.vertices)), numpy.diff(self.indptr))]
+        cols = self.indices.astype(numpy.int64)
+        candidates = numpy.empty(len(rows), dtype=CANDIDATE_DTYPE)
+        candidates['u'] = numpy.minimum(rows, cols)
+        candidates['v'] = numpy.maximum(rows, cols)
+        candidates['score'] = self.data
+        return unique_pairs(candidates)
+
+    def projection(self, columns):
+        """
+        Symmetric CSR arrays (indptr, indices, data) of the graph on the
+        vertices of the index, where columns maps a vertex of the graph to its
+        row. A pair is an edge if either end kept the other. The matrix is
+        built in memory, so it is only as small as the sparsified rows.
+        """
+
+        size = len(self.vertices)
+        matrix = sparse.csr_matrix((self.data, columns[self.indices], self.indptr), shape=(size, size))
+        matrix = matrix.maximum(matrix.T).tocsr()
+        matrix.sort_indices()
+        return matrix.indptr.astype(numpy.int64), matrix.indices.astype(numpy.int32), matrix.data
+
+
+def concatenate(indexes):
+    """ Index of the vertices of all indexes, in order. """
+
+    vertices = numpy.concatenate([index.vertices for index in indexes])
+    indptr = numpy.zeros(len(vertices) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.concatenate([numpy.diff(index.indptr) for index in indexes]), out=indptr[1:])
+    indices = numpy.concatenate([index.indices for index in indexes])
+    data = numpy.concatenate([index.data for index in indexes])
+    return TwoHopIndex(None, vertices, arrays=(indptr, indices, data))
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Uncoarsening
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program comes with ABSOLUTELY NO WARRANTY. THE ENTIRE RISK AS TO THE QUALITY AND PERFORMANCE OF THE PROGRAM IS
+WITH YOU.
+
+Owner or contributors are not liable for any direct, indirect, incidental, special, exemplary, or consequential
+damages, (such as loss of data or profits, and others) arising in any way out of the use of this software,
+even if advised of the possibility of such damage.
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+
+Giving credit to the author by citing the papers.
+"""
+
+__maintainer__ = 'Alan Valejo'
+__email__ = 'alanvalejo@gmail.com'
+__author__ = 'Alan Valejo'
+__credits__ = ['Alan Valejo']
+__homepage__ = 'https://www.alanvalejo.com.br'
+__license__ = 'GNU.GPL.v3'
+__docformat__ = 'markdown en'
+__version__ = '0.1'
+__date__ = '2020-05-05'
+
+import numpy
+
+from models.mgraph import offsets
+
+# Default number of refinement passes at each level
+REFINEMENT_ITR = 10
+
+# Default imbalance of refined partitions: a part weighs at most (1 + imbalance) times the average
+REFINEMENT_IMBALANCE = 0.03
+
+
+def best_labels(graph, vertices, labels):
+    """
+    Label of largest total edge weight among the neighbors of each vertex
+    (ties keep the smallest label), its weight, and the weight of the
+    neighbors sharing the current label of the vertex.
+    """
+
+    lengths = graph.indptr[vertices + 1] - graph.indptr[vertices]
+    ptr = offsets(lengths)
+    owner = numpy.repeat(numpy.arange(len(vertices)), lengths)
+    entries = numpy.arange(ptr[-1]) - ptr[owner] + graph.indptr[vertices][owner]
+    neighbor_labels = labels[graph.indices[entries]]
+
+    # Total weight of each (vertex, label) pair
+    order = numpy.lexsort((neighbor_labels, owner))
+    owner, neighbor_labels, weights = owner[order], neighbor_labels[order], graph.data[entries][order]
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = (owner[1:] != owner[:-1]) | (neighbor_labels[1:] != neighbor_labels[:-1])
+    starts = numpy.flatnonzero(first)
+    owner, neighbor_labels = owner[starts], neighbor_labels[starts]
+    scores = numpy.add.reduceat(weights, starts) if len(starts) else numpy.zeros(0)
+
+    best = labels[vertices].copy()
+    best_score = numpy.zeros(len(vertices))
+    order = numpy.lexsort((neighbor_labels, -scores, owner))
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = owner[order][1:] != owner[order][:-1]
+    best[owner[order[first]]] = neighbor_labels[order[first]]
+    best_score[owner[order[first]]] = scores[order[first]]
+
+    current_score = numpy.zeros(len(vertices))
+    same = neighbor_labels == labels[vertices][owner]
+    current_score[owner[same]] = scores[same]
+    return best, best_score, current_score
+
+
+def refine(graph, labels, itr=REFINEMENT_ITR, imbalance=REFINEMENT_IMBALANCE):
+    """
+    Boundary label propagation: a vertex takes the label of largest total
+    edge weight among its neighbors if it beats its own label. The first
+    pass visits the boundary vertices, those with a neighbor of another
+    label, and each further pass only the neighbors of the vertices that
+    changed, so the work follows the changes. The layers are updated in
+    turn; vertices of a layer are not adjacent in a bipartite graph, so
+    their moves do not change each other's gains. Moves are accepted in
+    decreasing order of gain as long as the new part of the vertex weighs
+    at most (1 + imbalance) times the average part (vertex weights, see
+    graph.weight) and the old part is not emptied.
+    """
+
+    parts, labels = numpy.unique(labels, return_inverse=True)
+    labels = labels.ravel().astype(numpy.int64)
+    weight = numpy.asarray(graph.weight, dtype=numpy.int64)
+    part_weight = numpy.bincount(labels, weights=weight, minlength=len(parts))
+    max_weight = (1.0 + imbalance) * part_weight.sum() / len(parts)
+
+    rows = numpy.repeat(numpy.arange(graph.vcount()), numpy.diff(graph.indptr))
+    active = numpy.zeros(graph.vcount(), dtype=bool)
+    active[rows[labels[rows] != labels[graph.indices]]] = True
+
+    for _ in range(itr):
+        changed = numpy.zeros(graph.vcount(), dtype=bool)
+        for layer in range(graph['layers']):
+            vertices = numpy.flatnonzero(active & (graph.type == layer))
+            if len(vertices) == 0:
+                continue
+            best, best_score, current_score = best_labels(graph, vertices, labels)
+            gain = best_score - current_score
+            moves = numpy.flatnonzero(gain > 0)
+            moves = moves[numpy.argsort(-gain[moves], kind='stable')]
+            for vertex, target in zip(vertices[moves].tolist(), best[moves].tolist()):
+                source = labels[vertex]
+                if part_weight[target] + weight[vertex] > max_weight or part_weight[source] <= weight[vertex]:
+                    continue
+                part_weight[source] -= weight[vertex]
+                part_weight[target] += weight[vertex]
+                labels[vertex] = target
+                changed[vertex] = True
+        if not changed.any():
+            break
+        active[:] = False
+        active[graph.indices[numpy.flatnonzero(changed[rows])]] = True
+
+    return parts[labels]
+
+
+class Uncoarsening(object):
+    """
+    Projection between the levels of a hierarchy, built on the successor
+    arrays of its levels: level 0 is the source graph and level k the k-th
+    coarsened graph. Maps from a level to a coarser one are compositions of
+    successor arrays, so moving values (partitions, labels, embeddings) one
+    level down is a single indexing.
+    """
+
+    def __init__(self, source_graph, hierarchy_graphs):
+        self.source_graph = source_graph
+        self.hierarchy_graphs = hierarchy_graphs
+
+    def __len__(self):
+        return len(self.hierarchy_graphs) + 1
+
+    def graph(self, level):
+        """ Graph of a level. """
+
+        if level == 0:
+            return self.source_graph
+        return self.hierarchy_graphs[level - 1]
+
+    def successor(self, level):
+        """ Vertex of level + 1 each vertex of the level is merged into. """
+
+        return numpy.asarray(self.graph(level).successor)
+
+    def membership(self, level, start=0):
+        """ Vertex of the level each vertex of the start level belongs to. """
+
+        if level < start or level >= len(self):
+            raise IndexError('Hierarchy level out of range.')
+        membership = numpy.arange(self.graph(start).vcount())
+        for index in range(start, level):
+            membership = self.successor(index)[membership]
+        return membership
+
+    def memberships(self):
+        """ Membership of the source vertices at each coarsened level, from the first. """
+
+        membership = numpy.arange(self.source_graph.vcount())
+        for level in range(1, len(self)):
+            membership = self.successor(level - 1)[membership]
+            yield level, membership
+
+    def project(self, values, level, target=0):
+        """
+        Values of the vertices of the target level taken from the vertices of
+        a coarser level they belong to; values is indexed by vertex on its first
+        axis, e.g., a partition or an embedding with one row per vertex.
+        """
+
+        return numpy.asarray(values)[self.membership(level, start=target)]
+
+    def uncoarsen(self, labels, level, itr=REFINEMENT_ITR, imbalance=REFINEMENT_IMBALANCE):
+        """
+        Labels (e.g. a partition) of the vertices of a level projected down to
+        the source graph, refined at each level on the way (see refine).
+        """
+
+        labels = refine(self.graph(level), labels, itr=itr, imbalance=imbalance)
+        for index in range(level - 1, -1, -1):
+            labels = refine(self.graph(index), labels[self.successor(index)], itr=itr, imbalance=imbalance)
+        return labels
+
+    def prolong(self, values, level):
+        """ Values projected one level at a time from the level down to the source graph, as (level, values). """
+
+        values = numpy.asarray(values)
+        for index in range(level - 1, -1, -1):
+            values = values[self.successor(index)]
+            yield index, values
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the parameter validation of the coarsening
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+"""
+
+import os
+import glob
+import tempfile
+import unittest
+
+import numpy
+
+from scipy import sparse
+
+import mfbn
+
+from models.mgraph import MGraph
+from models.coarsening import Coarsening, coarsen
+
+current_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def small_graph(vertices):
+    """ Bipartite graph linking each vertex of the first layer to one of the second. """
+
+    rows = numpy.arange(vertices[0])
+    graph = MGraph()
+    graph.from_edges(rows, vertices[0] + rows % vertices[1], None, vertices)
+    return graph
+
+
+class TestParameters(unittest.TestCase):
+
+    def test_sample_configurations_are_valid(self):
+        filenames = sorted(glob.glob(os.path.join(current_path, 'input', '*.json')))
+        self.assertTrue(filenames)
+        with tempfile.TemporaryDirectory() as directory:
+            for filename in filenames:
+                with self.subTest(filename=os.path.basename(filename)):
+                    options = mfbn.setup_options(['-cnf', filename], {'output_directory': directory})
+                    options.input = os.path.join(current_path, options.input)
+                    Coarsening(mfbn.load_graph(options), **dict(mfbn.coarsening_kwargs(options), threads=1))
+
+    def test_unused_parameters_may_be_none(self):
+        graph = small_graph([6, 6])
+        Coarsening(graph, matching='gmb', itr=None, upper_bound=None, tolerance=None, mnmf_rank=None)
+        Coarsening(graph, matching='hem', gmv=3, max_levels=None, top_k=None)
+        with self.assertRaisesRegex(ValueError, 'of itr is invalid'):
+            Coarsening(graph, matching='mlpb', itr=None)
+        with self.assertRaisesRegex(ValueError, 'of max_levels is invalid'):
+            Coarsening(graph, matching='gmb', max_levels=None)
+
+    def test_out_of_range_values(self):
+        graph = small_graph([6, 6])
+        for params in [
+            dict(top_k=0), dict(top_k=-1), dict(hub_degree=-1), dict(matching='mlpb', mlpb_chunk=0),
+            dict(matching='mnmf', mnmf_rank=0), dict(matching='mnmf', mnmf_batch=0), dict(similarity_cache=0),
+            dict(matching='hem', projection_mem_limit=-1), dict(matching='hem', projection_mem_limit='-1G')
+        ]:
+            name = [key for key in params if key != 'matching'][0]
+            with self.subTest(**params):
+                with self.assertRaisesRegex(ValueError, '^Value .* of ' + name + ' is invalid.$'):
+                    Coarsening(graph, **params)
+        Coarsening(graph, top_k=1, hub_degree=0, matching='mlpb', mlpb_chunk=1)
+
+    def test_vertices_must_match_the_graph(self):
+        biadjacency = sparse.random(5, 4, density=0.5, format='csr', random_state=0)
+        with self.assertRaisesRegex(ValueError, 'of vertices is invalid'):
+            coarsen(biadjacency, vertices=[4, 5])
+        with self.assertRaisesRegex(ValueError, 'of vertices is invalid'):
+            coarsen(small_graph([6, 6]), vertices=[5, 7])
+        self.assertTrue(coarsen(biadjacency, vertices=[5, 4], max_levels=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the label propagation of mlpb
+
+Copyright (C) 2020 Alan Valejo <alanvalejo@gmail.com> All rights reserved
+
+This program is free software and distributed in the hope that it will be useful: you can redistribute it and/or
+modify it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with this program. If not,
+see http://www.gnu.org/licenses/.
+"""
+
+import math
+import operator
+import unittest
+import collections
+
+import numpy
+
+from models.mgraph import MGraph
+from models.similarity import Similarity
+
+
+def random_graph(vertices, edges, seed):
+    """ Random bipartite graph with integer weights. """
+
+    random = numpy.random.RandomState(seed)
+    rows = random.randint(0, vertices[0], edges)
+    cols = vertices[0] + random.randint(0, vertices[1], edges)
+    graph = MGraph()
+    graph.from_edges(rows, cols, random.randint(1, 4, edges).astype(float), vertices)
+    return graph
+
+
+def sequential_mlpb(graph, vertices, vertices_id, itr, tolerance, upper_bound, n, min_vertices):
+    """ The sequential sweep of mlpb, one vertex at a time with dictionaries, as mlpb was written before arrays. """
+
+    max_size = int(math.ceil(((1.0 + upper_bound) * n) / min_vertices))
+    number_of_vertices = len(vertices)
+    weight_of_sv = graph.weight.tolist()
+    vertex_weight = graph.weight.tolist()
+    label_dict = dict(zip(vertices.tolist(), vertices.tolist()))
+
+    tolerance = tolerance * len(vertices)
+    swap = tolerance + 1
+    while (tolerance < swap) and itr:
+        swap = 0
+        itr -= 1
+        for vertex in vertices_id:
+            twohops = set()
+            for neighbor in graph.neighbors(vertex).tolist():
+                twohops.update(graph.neighbors(neighbor).tolist())
+            twohops.discard(vertex)
+
+            Q = collections.defaultdict(float)
+            for twohop in sorted(twohops):
+                similarity = graph['similarity'](vertex, twohop)
+                if weight_of_sv[label_dict[twohop]] + vertex_weight[vertex] <= max_size and similarity > 0.0:
+                    Q[label_dict[twohop]] += similarity
+            total_similarity = sum(Q.values())
+            for label in Q.keys():
+                Q[label] -= (total_similarity - Q[label])
+
+            if Q:
+                dominant_label = max(Q.items(), key=operator.itemgetter(1))[0]
+                prev_label = label_dict[vertex]
+                if dominant_label != prev_label:
+                    swap += 1
+                    label_dict[vertex] = dominant_label
+                    weight_of_sv[prev_label] -= vertex_weight[vertex]
+                    weight_of_sv[dominant_label] += vertex_weight[vertex]
+                    if weight_of_sv[prev_label] == 0:
+                        number_of_vertices -= 1
+                    if number_of_vertices <= min_vertices:
+                        tolerance = swap
+                        break
+
+    matching = numpy.full(graph.vcount(), -1, dtype=numpy.int64)
+    for vertex, label in label_dict.items():
+        matching[vertex] = label
+    return matching
+
+
+class TestMlpb(unittest.TestCase):
+
+    def test_default_sweep_is_sequential(self):
+        # Layers far larger than a window of the sweep, and than a chunk of 1000 chunks per sweep
+        graph = random_graph([2500, 2200], 9000, seed=1)
+        for measure in ['common_neighbors', 'weighted_common_neighbors']:
+            graph['similarity'] = Similarity(graph, measure=measure)
+            for layer in range(2):
+                vertices = graph['vertices_by_type'][layer]
+                for upper_bound, gmv in [(0.2, None), (0.8, None), (0.2, 1500)]:
+                    result = graph.mlpb(
+                        vertices, seed_priority='degree', reduction_factor=0.5, itr=10, tolerance=0.001,
+                        upper_bound=upper_bound, n=len(vertices), gmv=gmv
+                    )
+                    min_vertices = gmv if gmv else int(0.5 * len(vertices))
+                    expected = sequential_mlpb(
+                        graph, vertices, graph.seed_order(vertices, seed_priority='degree'), 10, 0.001, upper_bound,
+                        len(vertices), min_vertices
+                    )
+                    numpy.testing.assert_array_equal(result, expected)
+
+    def test_chunks_are_committed_in_order(self):
+        graph = random_graph([2500, 2200], 9000, seed=2)
+        graph['similarity'] = Similarity(graph, measure='common_neighbors')
+        vertices = graph['vertices_by_type'][0]
+        kwargs = dict(seed_priority='degree', reduction_factor=0.5, itr=10, tolerance=0.001, n=len(vertices))
+        numpy.testing.assert_array_equal(graph.mlpb(vertices, chunk=1, **kwargs), graph.mlpb(vertices, **kwargs))
+        labels = graph.mlpb(vertices, chunk=500, **kwargs)[vertices]
+        max_size = int(math.ceil(1.2 * len(vertices) / int(0.5 * len(vertices))))
+        self.assertLessEqual(numpy.bincount(labels).max(), max_size)
+
+
+if __name__ == '__main__':
+    unittest.main()